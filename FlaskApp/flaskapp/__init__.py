@@ -2,23 +2,92 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-import os
+from sqlalchemy import event
+from flaskapp.config import Config
 
-app = Flask(__name__) # so Flask knows where to look for templates and static files
+db = SQLAlchemy()
+bcrypt = Bcrypt() # for hashing passwords
+login_manager = LoginManager()
 
-#with app.app_context():
-file_path = os.path.abspath(os.getcwd())+"\site.db"
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///'+file_path
+def engine_options(config):
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if not config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Pool sizing only applies to server databases
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', True)
+    return options
 
-app.config['SECRET_KEY'] = '0ebb980f435eef6cfaa76b5aebbff95d'
+def apply_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
 
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app) # for hashing passwords
-login_manager = LoginManager(app)
 
-from flaskapp import routes
+def create_app(config=Config):
+    # config is a class like Config or a dict of settings to use on top of Config
+    from flaskapp.warmup import StartupTimer
+    timer = StartupTimer() # how long each step takes, see flask startup-report
+    app = Flask(__name__) # so Flask knows where to look for templates and static files
+    app.extensions['startup'] = timer
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    else:
+        app.config.from_object(config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    timer.mark('config')
 
-# Need a secret key to protect against modifying cookies and cross site request forgery attacks
-#app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///dbdir/site.db'
-#app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
\ No newline at end of file
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    timer.mark('extensions')
+
+    # Per app state, so several apps in one process (tests) never share data
+    from flaskapp.search import SearchIndex
+    from flaskapp.facets import FacetIndex
+    from flaskapp.identity import IdentityCache
+    from flaskapp.pagecache import PageCache
+    from flaskapp.passwords import PasswordHasher
+    app.extensions['search_index'] = SearchIndex()
+    app.extensions['facet_index'] = FacetIndex()
+    app.extensions['identity_cache'] = IdentityCache()
+    app.extensions['page_cache'] = PageCache(app.config)
+    app.extensions['password_hasher'] = PasswordHasher()
+    timer.mark('caches')
+
+    if app.config['METRICS_ENABLED']:
+        from flaskapp.metrics import instrument
+        instrument(app)
+        timer.mark('metrics')
+
+    from flaskapp.routes import main
+    from flaskapp.images import images, thumbnail_filter, display_filter
+    from flaskapp.storage import cache_images
+    from flaskapp.stats import stats
+    from flaskapp.bookings import bookings
+    from flaskapp.jobs import jobs
+    from flaskapp.migrations import db_cli
+    from flaskapp.benchmarks import bench
+    from flaskapp.catalogue import items_cli
+    from flaskapp.warmup import startup_report_command
+    timer.mark('import modules')
+    app.register_blueprint(main)
+    app.add_template_filter(thumbnail_filter, 'thumbnail')
+    app.add_template_filter(display_filter, 'display')
+    app.after_request(cache_images)
+    for group in (db_cli, stats, bookings, images, jobs, items_cli, bench, startup_report_command):
+        app.cli.add_command(group)
+    timer.mark('register')
+
+    return app
@@ -0,0 +1,33 @@
+from datetime import timedelta
+from flaskapp import db
+from flaskapp.models import Rentals
+
+# ------------- AVAILABILITY ------------- #
+
+# Rentals are closed date ranges, so a booking ending on the 5th blocks a new one starting on the 5th.
+# Both lookups are range scans on the (itemID, startDate, endDate) index on Rentals.
+
+def overlapping(item_id, start, end):
+    # Rentals for the item that overlap the chosen dates
+    return Rentals.query.filter(Rentals.itemID == item_id, Rentals.startDate <= end, Rentals.endDate >= start)
+
+def is_available(item_id, start, end):
+    # A single EXISTS query instead of looping over the item's whole rental history
+    return not db.session.query(overlapping(item_id, start, end).exists()).scalar()
+
+def bookings_query(item_id, start):
+    # The item's rentals that have not ended by start, in date order
+    return db.session.query(Rentals.startDate, Rentals.endDate).filter(Rentals.itemID == item_id, Rentals.endDate >= start).order_by(Rentals.startDate)
+
+def next_free_window(item_id, start, end):
+    # Earliest (start, end) pair on or after the chosen start date with the same length that is free
+    length = end - start
+
+    # Walk future bookings in date order, pushing the window past each one it collides with
+    for bookedStart, bookedEnd in bookings_query(item_id, start):
+        if bookedStart > start + length:
+            break
+        if bookedEnd >= start:
+            start = bookedEnd + timedelta(days=1)
+
+    return start, start + length
@@ -0,0 +1,123 @@
+import click
+import json
+import os
+from flask.cli import AppGroup
+from flaskapp import db, create_app
+from flaskapp.models import Items
+
+# ------------- BENCHMARKS ------------- #
+
+# flask bench seed   builds a synthetic catalogue in a scratch SQLite database
+# flask bench run    seeds it again and times /home, /search, /rent/<id> and /favourites
+# flask bench compare old.json new.json   shows how two runs differ
+#
+# Rentals made during a run change the database, so run reseeds first unless told not to.
+
+
+def bench_app(database, overrides=()):
+    settings = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(database), 'WTF_CSRF_ENABLED': False, 'IMAGE_JOBS_INLINE': False}
+    for override in overrides:
+        # KEY=VALUE, the value is read as JSON when it can be, e.g. PAGE_CACHE_ENABLED=false
+        key, _, value = override.partition('=')
+        try:
+            settings[key] = json.loads(value)
+        except ValueError:
+            settings[key] = value
+    return create_app(settings)
+
+def reseed(database, overrides, volumes, seed):
+    from flaskapp.benchmarks.catalogue import seed_catalogue
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    with bench_app(database, overrides).app_context():
+        counts = seed_catalogue(seed=seed, **volumes)
+        db.session.remove()
+        db.engine.dispose()
+    return counts
+
+
+def volume_options(command):
+    for name, default in reversed((('users', 1000), ('items', 5000), ('rentals', 20000), ('favourites', 20000))):
+        command = click.option(f'--{name}', default=default, show_default=True, help=f'Synthetic {name} to create.')(command)
+    return command
+
+database_option = click.option('--database', default='benchmark.db', show_default=True, help='Scratch SQLite file, it is wiped when seeding.')
+seed_option = click.option('--seed', default=1, show_default=True, help='Random seed for the catalogue and the request mix.')
+
+
+@click.group(cls=AppGroup)
+def bench():
+    """Synthetic catalogue and load benchmarks."""
+
+@bench.command('seed')
+@database_option
+@volume_options
+@seed_option
+def seed_command(database, users, items, rentals, favourites, seed):
+    """Create a synthetic catalogue."""
+    counts = reseed(database, (), {'users': users, 'items': items, 'rentals': rentals, 'favourites': favourites}, seed)
+    click.echo(json.dumps(counts))
+
+@bench.command('run')
+@database_option
+@volume_options
+@seed_option
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(['home', 'search', 'rent', 'favourites']), help='Pages to time, all of them by default.')
+@click.option('--requests', default=200, show_default=True, help='Timed requests per scenario for each client.')
+@click.option('--clients', default=4, show_default=True, help='Clients sending requests at the same time.')
+@click.option('--warmup', default=20, show_default=True, help='Untimed requests each client makes first.')
+@click.option('--wsgi', is_flag=True, help='Send real HTTP requests to a local server instead of using the test client.')
+@click.option('--reuse', is_flag=True, help='Use the existing database instead of seeding it again.')
+@click.option('--set', 'overrides', multiple=True, metavar='KEY=VALUE', help='Config setting for the app under test, can be repeated.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the JSON report here as well as printing it.')
+def run_command(database, users, items, rentals, favourites, seed, scenarios, requests, clients, warmup, wsgi, reuse, overrides, output):
+    """Time the main pages and report latency percentiles, throughput and peak RSS as JSON."""
+    from flaskapp.benchmarks.runner import run_benchmark, LoginFailed, SCENARIOS
+    if clients > users:
+        raise click.BadParameter('needs at least one user per client', param_hint='--clients')
+    if reuse:
+        counts = None
+    else:
+        # Seeding builds the whole catalogue in memory, do it in another process so it does
+        # not count towards the peak RSS of the run
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(1) as pool:
+            counts = pool.submit(reseed, database, overrides, {'users': users, 'items': items, 'rentals': rentals, 'favourites': favourites}, seed).result()
+
+    app = bench_app(database, overrides)
+    with app.app_context():
+        item_count = db.session.query(db.func.max(Items.id)).scalar() or 1
+    try:
+        report = run_benchmark(app, scenarios or SCENARIOS, requests, clients, warmup, seed, wsgi, item_count)
+    except LoginFailed as error:
+        raise click.ClickException(str(error))
+    report['catalogue'] = counts
+    report['options']['overrides'] = list(overrides)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    click.echo(text)
+
+@bench.command('compare')
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+def compare_command(before, after):
+    """Show the change in latency and throughput between two reports."""
+    before, after = json.load(before), json.load(after)
+    if before['options'] != after['options'] or before.get('catalogue') != after.get('catalogue'):
+        click.echo('Warning: the runs used different options or catalogues', err=True)
+    click.echo(f"{'scenario':<12}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for scenario in ['total'] + sorted(after['scenarios']):
+        old = before['total'] if scenario == 'total' else before['scenarios'].get(scenario)
+        new = after['total'] if scenario == 'total' else after['scenarios'][scenario]
+        if old is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if old[metric] is None or new[metric] is None:
+                continue
+            change = f'{(new[metric] - old[metric]) / old[metric] * 100:+.1f}%' if old[metric] else ''
+            click.echo(f'{scenario:<12}{metric:<16}{old[metric]:>12}{new[metric]:>12}{change:>10}')
+    click.echo(f"{'':<12}{'peak_rss_mb':<16}{before['peak_rss_mb']!s:>12}{after['peak_rss_mb']!s:>12}")
@@ -0,0 +1,95 @@
+import os
+import random
+from datetime import date, timedelta
+from flaskapp import db, bcrypt
+from flaskapp.models import Users, Items, Rentals, Favourites
+from flaskapp.facets import VOCABULARIES
+from flaskapp.images import image_dir
+from flaskapp.migrations import upgrade
+from flaskapp.stats import recompute_all
+
+# ------------- SYNTHETIC CATALOGUE ------------- #
+
+# Fills an empty database with users, items, rentals and favourites. Everything comes from
+# one seeded random generator, so the same seed and volumes give the same rows every time.
+# A few users post most items and a few items get most rentals and favourites, like a real
+# catalogue, so hot items and long favourites lists both show up in the timings.
+
+BRANDS = ['Zara', 'Nike', 'Adidas', 'Gucci', 'Prada', 'Uniqlo', 'Levis', 'Mango', 'Asos', 'Boss',
+          'Primark', 'Gap', 'Diesel', 'Puma', 'Reebok', 'Topshop', 'Hollister', 'Vans', 'Lacoste', 'Burberry']
+
+# Everyone signs in with this, the benchmark logs clients in before timing starts
+PASSWORD = 'benchmark'
+
+CHUNK = 5000
+
+
+def skewed(rng, count, power=3):
+    # Index in range(count), low indexes much more likely. With power 3 the first 1% of
+    # indexes get about a fifth of the picks
+    return min(int(count * rng.random() ** power), count - 1)
+
+def insert(model, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.bulk_insert_mappings(model, rows[start:start + CHUNK])
+    db.session.commit()
+
+def seed_catalogue(users=1000, items=5000, rentals=20000, favourites=20000, seed=1):
+    # Run inside an app context on an empty database, returns the row counts written
+    rng = random.Random(seed)
+    upgrade()
+
+    # bcrypt is slow, every synthetic user shares one hash
+    password = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    insert(Users, [{'id': n, 'username': f'bench{n:06d}', 'password': password, 'credit_balance': 10 ** 6} for n in range(1, users + 1)])
+
+    # Items reuse the images already in the upload folder
+    pictures = sorted(name for name in os.listdir(image_dir()) if os.path.isfile(os.path.join(image_dir(), name))) or ['default.jpg']
+    # Posters and brands are shuffled once so the popular ones are not always the lowest ids
+    posters = list(range(1, users + 1))
+    rng.shuffle(posters)
+    brands = BRANDS[:]
+    rng.shuffle(brands)
+    insert(Items, [{
+        'id': n,
+        'userID': posters[skewed(rng, users)],
+        'typeOfClothing': rng.choice(VOCABULARIES['typeOfClothing']),
+        'colour': rng.choices(VOCABULARIES['colour'], weights=range(len(VOCABULARIES['colour']), 0, -1))[0],
+        'size': rng.choices(VOCABULARIES['size'], weights=[1, 3, 8, 10, 8, 3, 1])[0],
+        'brand': brands[skewed(rng, len(brands), 2)],
+        'minimumCredits': max(5, min(200, int(rng.lognormvariate(3, 0.6)))),
+        'image_file': rng.choice(pictures),
+        'image_status': 'ready',
+    } for n in range(1, items + 1)])
+
+    # Rentals follow each other without overlapping on every item, spread over the last
+    # six months and the next three so pricing and availability checks have history to read
+    popular = list(range(1, items + 1))
+    rng.shuffle(popular)
+    nextFree = {}
+    firstDay = date.today() - timedelta(days=180)
+    lastDay = date.today() + timedelta(days=90)
+    rows = []
+    for _ in range(rentals * 5):
+        if len(rows) >= rentals:
+            break
+        item_id = popular[skewed(rng, items)]
+        startDate = nextFree.get(item_id, firstDay + timedelta(days=rng.randint(0, 60))) + timedelta(days=rng.randint(0, 10))
+        endDate = startDate + timedelta(days=rng.randint(1, 7))
+        if endDate > lastDay:
+            # This item is booked solid, try another
+            continue
+        nextFree[item_id] = endDate + timedelta(days=1)
+        rows.append({'itemID': item_id, 'userID': rng.randint(1, users), 'startDate': startDate, 'endDate': endDate, 'credit': rng.randint(10, 80)})
+    insert(Rentals, rows)
+
+    # Each user/item pair is only favourited once
+    pairs = set()
+    for _ in range(favourites * 2):
+        if len(pairs) >= favourites:
+            break
+        pairs.add((rng.randint(1, users), popular[skewed(rng, items)]))
+    insert(Favourites, [{'userID': user_id, 'itemID': item_id} for user_id, item_id in sorted(pairs)])
+
+    recompute_all()
+    return {'users': users, 'items': items, 'rentals': len(rows), 'favourites': len(pairs)}
@@ -0,0 +1,210 @@
+import http.cookiejar
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import date, timedelta
+from werkzeug.serving import make_server
+from flaskapp.benchmarks.catalogue import BRANDS, PASSWORD
+from flaskapp.facets import VOCABULARIES
+
+# ------------- LOAD RUNNER ------------- #
+
+# Each client logs in as its own synthetic user, then replays a request mix made by a
+# random generator seeded from the run seed and its client number. The same seed,
+# volumes and options give the same requests, so runs from two commits can be compared.
+
+SCENARIOS = ('home', 'search', 'rent', 'favourites')
+
+
+def plan(rng, scenario, items):
+    # Returns (method, path, form data) for one request
+    if scenario == 'home':
+        # Mostly the first page, sometimes deeper into the feed
+        if rng.random() < 0.7:
+            return 'GET', '/home', None
+        return 'GET', f'/home?after={rng.randint(1, items)}', None
+    if scenario == 'search':
+        words = [rng.choice(VOCABULARIES['colour']), rng.choice(VOCABULARIES['typeOfClothing']), rng.choice(BRANDS)]
+        return 'POST', '/search', {'searched': ' '.join(rng.sample(words, rng.randint(1, 3)))}
+    if scenario == 'rent':
+        # Half the visits only open the item, the others try to book it
+        item_id = rng.randint(1, items)
+        if rng.random() < 0.5:
+            return 'GET', f'/rent/{item_id}', None
+        startDate = date.today() + timedelta(days=rng.randint(1, 120))
+        endDate = startDate + timedelta(days=rng.randint(1, 5))
+        return 'POST', f'/rent/{item_id}', {'startDate': startDate.isoformat(), 'endDate': endDate.isoformat()}
+    return 'GET', '/favourites', None
+
+def expected_statuses(scenario, method):
+    # A booking redirects home and dates that are taken show the form again, every other page
+    # answers 200. Anything else, like a redirect after the session was lost, is an error
+    if scenario == 'rent' and method == 'POST':
+        return (200, 302)
+    return (200,)
+
+
+class LoginFailed(RuntimeError):
+    pass
+
+
+class TestClient:
+    # Drives the app in process through Flask's test client
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data):
+        # Returns the status and the redirect location, if any
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, response.headers.get('Location')
+
+
+class HttpClient:
+    # Drives a real WSGI server over HTTP, with its own cookie jar for the session
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self.NoRedirect())
+
+    def request(self, method, path, data):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status, response.headers.get('Location')
+        except urllib.error.HTTPError as error:
+            # Redirects end up here too as they are not followed
+            error.read()
+            return error.code, error.headers.get('Location')
+
+
+def percentile(ordered, fraction):
+    # Nearest rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def summarise(latencies, unexpected, elapsed):
+    # unexpected counts the responses with a status the scenario should not give, by status
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': sum(unexpected.values()),
+        'unexpected_statuses': {str(status): count for status, count in sorted(unexpected.items())},
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None,
+    }
+
+def peak_rss_mb():
+    # Peak memory of this process only, the catalogue is seeded in a separate one.
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS, Windows has no resource module
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(app, scenarios=SCENARIOS, requests=200, clients=4, warmup=20, seed=1, wsgi=False, items=1):
+    # Each client makes warmup untimed requests, then requests timed ones per scenario
+    server = None
+    if wsgi:
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    results = {scenario: [] for scenario in scenarios}
+    errors = {scenario: Counter() for scenario in scenarios}
+    failures = []
+    lock = threading.Lock()
+
+    def client_loop(number, ready, go):
+        rng = random.Random(f'{seed}-{number}')
+        try:
+            client = HttpClient(base_url) if wsgi else TestClient(app)
+            username = f'bench{number + 1:06d}'
+            status, location = client.request('POST', '/login', {'username': username, 'password': PASSWORD})
+            # A logged out client would time redirects and the login page instead of the real pages
+            if status != 302 or urllib.parse.urlsplit(location or '').path != '/home':
+                raise LoginFailed(f'{username} could not log in, the login page answered {status}')
+            mix = [scenario for scenario in scenarios for _ in range(requests)]
+            rng.shuffle(mix)
+            for scenario in rng.choices(scenarios, k=warmup):
+                client.request(*plan(rng, scenario, items))
+        except Exception as error:
+            failures.append(error)
+            return
+        finally:
+            # A client that failed to start must not leave the others waiting for it
+            ready.release()
+        go.wait()
+
+        timings = {scenario: [] for scenario in scenarios}
+        failed = {scenario: Counter() for scenario in scenarios}
+        for scenario in mix:
+            method, path, data = plan(rng, scenario, items)
+            started = time.perf_counter()
+            status, _ = client.request(method, path, data)
+            timings[scenario].append(time.perf_counter() - started)
+            if status not in expected_statuses(scenario, method):
+                failed[scenario][status] += 1
+        with lock:
+            for scenario in scenarios:
+                results[scenario].extend(timings[scenario])
+                errors[scenario].update(failed[scenario])
+
+    # Every client finishes logging in and warming up before the clock starts
+    ready = threading.Semaphore(0)
+    go = threading.Event()
+    threads = [threading.Thread(target=client_loop, args=(number, ready, go)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        ready.acquire()
+    started = time.perf_counter()
+    go.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        server.shutdown()
+    if failures:
+        raise failures[0]
+
+    everything = [latency for scenario in scenarios for latency in results[scenario]]
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'options': {'scenarios': list(scenarios), 'requests': requests, 'clients': clients, 'warmup': warmup, 'seed': seed, 'driver': 'wsgi' if wsgi else 'test_client'},
+        'elapsed_s': round(elapsed, 3),
+        'total': summarise(everything, sum(errors.values(), Counter()), elapsed),
+        'scenarios': {scenario: summarise(results[scenario], errors[scenario], elapsed) for scenario in scenarios},
+        'peak_rss_mb': peak_rss_mb(),
+    }
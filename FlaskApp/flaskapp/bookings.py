@@ -0,0 +1,165 @@
+import click
+import random
+import threading
+import time
+from datetime import date, timedelta
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from flaskapp import db, create_app
+from flaskapp.models import Users, Items, Rentals
+from flaskapp.availability import is_available
+from flaskapp.stats import item_stats, record_rental
+from flaskapp.identity import identity_cache
+
+# ------------- BOOKINGS ------------- #
+
+# Renting an item checks availability, moves credits and records the rental in one
+# write transaction, so parallel requests cannot double book or lose balance updates.
+
+
+class BookingError(Exception):
+    pass
+
+class ItemUnavailable(BookingError):
+    pass
+
+class InsufficientCredits(BookingError):
+    pass
+
+
+def is_contention(error):
+    # SQLite reports a busy write lock as "database is locked", server databases as deadlocks/serialisation failures
+    message = str(error.orig).lower()
+    return 'locked' in message or 'deadlock' in message or 'could not serialize' in message
+
+def begin_write(item_id):
+    if db.engine.dialect.name == 'sqlite':
+        # Take the write lock up front so the availability check and the writes see the same data
+        db.session.execute(text('BEGIN IMMEDIATE'))
+    else:
+        # Bookings for the same item queue up behind this row lock
+        Items.query.filter_by(id=item_id).with_for_update().one()
+
+def _book(item, renter, startDate, endDate, credits):
+    begin_write(item.id)
+
+    if not is_available(item.id, startDate, endDate):
+        raise ItemUnavailable()
+
+    # Make sure the stats row exists before the rental is added, under the write lock, so no
+    # rental can land between counting an item's history and creating its row
+    item_stats(item.id)
+
+    # The balance guard is part of the UPDATE, so two rentals can never spend the same credits
+    debited = Users.query.filter(Users.id == renter.id, Users.credit_balance >= credits).update(
+        {Users.credit_balance: Users.credit_balance - credits}, synchronize_session=False)
+    if not debited:
+        raise InsufficientCredits()
+
+    # Transfer credits to item owner
+    Users.query.filter(Users.id == item.userID).update(
+        {Users.credit_balance: Users.credit_balance + credits}, synchronize_session=False)
+
+    rental = Rentals(userID=renter.id, itemID=item.id, startDate=startDate, endDate=endDate, credit=credits)
+    db.session.add(rental)
+    record_rental(item.id, startDate, endDate)
+    db.session.commit()
+
+    # Both balances changed, make the next request load them again
+    identity_cache.invalidate(renter.id)
+    identity_cache.invalidate(item.userID)
+    return rental
+
+def book_rental(item, renter, startDate, endDate, credits):
+    # Finish whatever the request has done so far so the booking starts its own transaction
+    db.session.commit()
+
+    retries = current_app.config['BOOKING_RETRIES']
+    delay = current_app.config['BOOKING_RETRY_DELAY']
+    for attempt in range(retries + 1):
+        try:
+            return _book(item, renter, startDate, endDate, credits)
+        except BookingError:
+            db.session.rollback()
+            raise
+        except OperationalError as error:
+            db.session.rollback()
+            if attempt == retries or not is_contention(error):
+                raise
+            # Exponential backoff with jitter so retrying workers do not collide again
+            time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+# ------------- CLI ------------- #
+
+@click.group(cls=AppGroup)
+def bookings():
+    """Rental booking tools."""
+
+@bookings.command('loadtest')
+@click.option('--threads', default=32, help='Number of concurrent renters.')
+@click.option('--attempts', default=20, help='Bookings each renter tries to make.')
+@click.option('--database', default='sqlite:///bookings_loadtest.db', help='Scratch database, it is wiped first.')
+def loadtest_command(threads, attempts, database):
+    """Fire concurrent bookings at one item and check nothing was double booked."""
+    test_app = create_app({'SQLALCHEMY_DATABASE_URI': database, 'IMAGE_JOBS_INLINE': False})
+
+    with test_app.app_context():
+        db.drop_all()
+        db.create_all()
+        owner = Users(username='loadowner', password='x', credit_balance=0)
+        db.session.add(owner)
+        db.session.add_all([Users(username=f'renter{n}', password='x', credit_balance=1000) for n in range(threads)])
+        db.session.commit()
+        item = Items(userID=owner.id, brand='Load', colour='Black', typeOfClothing='Dress', size='M', minimumCredits=10)
+        db.session.add(item)
+        db.session.commit()
+        item_id = item.id
+        renter_ids = [user.id for user in Users.query.filter(Users.id != owner.id)]
+        total = db.session.query(db.func.sum(Users.credit_balance)).scalar()
+
+    outcomes = {'booked': 0, 'unavailable': 0, 'no credits': 0, 'errors': 0}
+    lock = threading.Lock()
+    firstDay = date.today()
+
+    def renter(renter_id):
+        with test_app.app_context():
+            user = Users.query.get(renter_id)
+            for _ in range(attempts):
+                # Random overlapping windows over a month so most requests collide
+                startDate = firstDay + timedelta(days=random.randint(0, 30))
+                endDate = startDate + timedelta(days=random.randint(1, 4))
+                item = Items.query.get(item_id)
+                try:
+                    book_rental(item, user, startDate, endDate, 10)
+                    outcome = 'booked'
+                except ItemUnavailable:
+                    outcome = 'unavailable'
+                except InsufficientCredits:
+                    outcome = 'no credits'
+                except OperationalError:
+                    outcome = 'errors'
+                with lock:
+                    outcomes[outcome] += 1
+            db.session.remove()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=renter, args=(renter_id,)) for renter_id in renter_ids]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with test_app.app_context():
+        rentals = Rentals.query.filter_by(itemID=item_id).order_by(Rentals.startDate).all()
+        overlaps = sum(1 for a, b in zip(rentals, rentals[1:]) if b.startDate <= a.endDate)
+        balance = db.session.query(db.func.sum(Users.credit_balance)).scalar()
+        db.session.remove()
+
+    click.echo(f"{threads * attempts} requests in {elapsed:.2f}s: {outcomes}")
+    click.echo(f"overlapping rentals: {overlaps}, credits created or lost: {balance - total}")
+    if overlaps or balance != total:
+        raise click.ClickException('Concurrent bookings were not isolated')
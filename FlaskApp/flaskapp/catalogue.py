@@ -0,0 +1,278 @@
+import click
+import csv
+import json
+import os
+import shutil
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from werkzeug.datastructures import FileStorage
+from flaskapp import db
+from flaskapp.models import Users, Items, ImageJobs
+from flaskapp.facets import VOCABULARIES
+from flaskapp.forms import UploadForm
+from flaskapp.images import image_dir, image_format
+from flaskapp.storage import store_upload
+from flaskapp.pagecache import page_cache
+
+# ------------- CATALOGUE IMPORT / EXPORT ------------- #
+
+# Moves many items in and out at once, e.g. a partner's whole wardrobe. Files are read and
+# written a row at a time and items are inserted a chunk at a time with one multi row
+# INSERT, so memory stays flat however big the file is. Each chunk's images are copied into
+# the store and resized by a pool of worker processes.
+
+COLUMNS = ('owner', 'typeOfClothing', 'colour', 'size', 'brand', 'minimumCredits', 'image')
+
+# Images are held to what the upload form accepts
+IMAGE_EXTENSIONS = tuple('.' + ext for ext in UploadForm.image.kwargs['validators'][0].upload_set)
+IMAGE_FORMATS = ('JPEG', 'PNG')
+
+# Settings the image workers need from the importing app
+WORKER_SETTINGS = ('SQLALCHEMY_DATABASE_URI', 'THUMBNAIL_SIZE', 'DISPLAY_SIZE', 'IMAGE_WEBP', 'IMAGE_QUALITY')
+
+
+class RowError(ValueError):
+    pass
+
+
+def file_format(filename, given):
+    if given:
+        return given
+    return 'jsonl' if filename.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_rows(f, fmt):
+    # Yields (line number, dict) one row at a time
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(f), start=2):
+            yield number, row
+    else:
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield number, RowError(f'not valid JSON: {error}')
+                    continue
+                yield number, row if isinstance(row, dict) else RowError(f'expected a JSON object, got {type(row).__name__}')
+
+def clean_row(row):
+    # Checks a row against what the upload form allows and formats it the same way
+    if isinstance(row, RowError):
+        raise row
+    item = {}
+    for field in ('typeOfClothing', 'colour', 'size'):
+        value = str(row.get(field) or '').strip()
+        if value not in VOCABULARIES[field]:
+            raise RowError(f'{field} must be one of {", ".join(VOCABULARIES[field])}, got {value!r}')
+        item[field] = value
+    brand = str(row.get('brand') or '').strip()
+    # n/a is what items without a brand are stored with, keep it so exports read back unchanged
+    item['brand'] = brand[0].upper()+brand[1:].lower() if brand and brand.lower() != 'n/a' else 'n/a'
+    try:
+        item['minimumCredits'] = int(row.get('minimumCredits'))
+    except (TypeError, ValueError):
+        raise RowError(f"minimumCredits must be a whole number, got {row.get('minimumCredits')!r}")
+    return item
+
+
+# ------------- IMAGE WORKERS ------------- #
+
+# Each worker process builds its own app once, so images are stored and resized with the
+# same code and settings as uploads
+
+def _start_worker(settings):
+    from flaskapp import create_app
+    app = create_app(dict(settings, IMAGE_JOBS_INLINE=False, METRICS_ENABLED=False))
+    app.app_context().push()
+
+def store_image(path, process):
+    # Copies one image into the store, returns its stored name
+    from flaskapp.jobs import process_image
+    # Checked before the file lands in the public image folder
+    if image_format(path) not in IMAGE_FORMATS:
+        raise ValueError(f'{os.path.basename(path)} is not a JPEG or PNG image')
+    with open(path, 'rb') as f:
+        image_fn = store_upload(FileStorage(stream=f, filename=path))
+    if process:
+        process_image(image_fn)
+    return image_fn
+
+def _store_image_job(args):
+    path, process = args
+    try:
+        return store_image(path, process), None
+    except (OSError, ValueError) as error:
+        return None, str(error)
+
+
+# ------------- IMPORT ------------- #
+
+def import_items(f, fmt, images_dir, owner, chunk_size, workers, defer_images, report):
+    # Returns (items imported, rows skipped). report(message) is called for each skipped row
+    owners = {}
+    if owner:
+        user = Users.query.filter_by(username=owner).first()
+        if user is None:
+            raise click.ClickException(f'No user called {owner}')
+        owners[owner] = user.id
+
+    pool = None
+    if images_dir and workers > 0:
+        from concurrent.futures import ProcessPoolExecutor # pulls in multiprocessing, only needed here
+        settings = {key: current_app.config[key] for key in WORKER_SETTINGS}
+        pool = ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(settings,))
+
+    imported = skipped = 0
+    try:
+        batch = []
+        for number, row in read_rows(f, fmt):
+            batch.append((number, row))
+            if len(batch) >= chunk_size:
+                done, failed = _import_batch(batch, images_dir, owner, owners, pool, defer_images, report)
+                imported += done
+                skipped += failed
+                batch = []
+        if batch:
+            done, failed = _import_batch(batch, images_dir, owner, owners, pool, defer_images, report)
+            imported += done
+            skipped += failed
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if imported:
+        page_cache.invalidate()
+    return imported, skipped
+
+def _import_batch(batch, images_dir, default_owner, owners, pool, defer_images, report):
+    items = []
+    skipped = 0
+
+    # Owners not seen in earlier batches are looked up in one query
+    wanted = {str(row.get('owner') or default_owner or '') for _, row in batch if isinstance(row, dict)} - owners.keys() - {''}
+    if wanted:
+        owners.update(db.session.query(Users.username, Users.id).filter(Users.username.in_(wanted)).all())
+
+    for number, row in batch:
+        try:
+            item = clean_row(row)
+            username = str(row.get('owner') or default_owner or '')
+            if username not in owners:
+                raise RowError(f'no user called {username!r}' if username else 'no owner given, use --owner')
+            item['userID'] = owners[username]
+            image = str(row.get('image') or '').strip()
+            if image:
+                if not images_dir:
+                    raise RowError('row names an image but no --images folder was given')
+                if os.path.splitext(image)[1].lower() not in IMAGE_EXTENSIONS:
+                    raise RowError(f'image {image} must be a {" or ".join(IMAGE_EXTENSIONS)} file')
+                # Only files inside --images are read, whatever the row says
+                root = os.path.realpath(images_dir)
+                path = os.path.realpath(os.path.join(root, image))
+                if os.path.commonpath([root, path]) != root:
+                    raise RowError(f'image {image} is outside the --images folder')
+                if not os.path.isfile(path):
+                    raise RowError(f'image {image} not found')
+                item['image'] = path
+        except RowError as error:
+            report(f'line {number}: {error}')
+            skipped += 1
+            continue
+        items.append(item)
+
+    # Each distinct image is stored once per batch, in parallel, and resized unless the job queue will do it
+    paths = sorted({item['image'] for item in items if 'image' in item})
+    if pool is not None:
+        stored = dict(zip(paths, pool.map(_store_image_job, [(path, not defer_images) for path in paths], chunksize=8)))
+    else:
+        stored = {path: _store_image_job((path, not defer_images)) for path in paths}
+
+    rows = []
+    for item in items:
+        path = item.pop('image', None)
+        if path is not None:
+            image_fn, error = stored[path]
+            if image_fn is None:
+                report(f'{os.path.basename(path)}: {error}')
+                skipped += 1
+                continue
+            item['image_file'] = image_fn
+            item['image_status'] = 'pending' if defer_images else 'ready'
+        rows.append(item)
+    if not rows:
+        return 0, skipped
+
+    # One executemany INSERT for the whole chunk, ids come back in row order for the image jobs
+    ids = db.session.scalars(insert(Items).returning(Items.id, sort_by_parameter_order=True), rows).all()
+    jobs = [{'itemID': item_id} for item_id, row in zip(ids, rows) if row.get('image_status') == 'pending']
+    if jobs:
+        db.session.execute(insert(ImageJobs), jobs)
+    db.session.commit()
+    return len(rows), skipped
+
+
+# ------------- EXPORT ------------- #
+
+def export_items(f, fmt, images_dir, chunk_size):
+    # Streams every item with its owner's name, returns how many were written
+    if images_dir:
+        os.makedirs(images_dir, exist_ok=True)
+    writer = csv.DictWriter(f, fieldnames=COLUMNS, lineterminator='\n') if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+
+    count = 0
+    query = db.session.query(Users.username, Items.typeOfClothing, Items.colour, Items.size, Items.brand, Items.minimumCredits, Items.image_file)\
+        .join(Users, Users.id == Items.userID).order_by(Items.id).execution_options(yield_per=chunk_size)
+    for row in query:
+        record = dict(zip(COLUMNS, row))
+        # Items without a stored original (the model's default.png, or a file since lost) are
+        # exported without an image, import gives them the default again
+        source = os.path.join(image_dir(), row.image_file)
+        if os.path.basename(row.image_file) != row.image_file or not os.path.isfile(source):
+            record['image'] = ''
+        elif images_dir:
+            # Originals are copied once, identical photos share a file
+            target = os.path.join(images_dir, row.image_file)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+        if writer:
+            writer.writerow(record)
+        else:
+            f.write(json.dumps(record) + '\n')
+        count += 1
+    return count
+
+
+# ------------- CLI ------------- #
+
+@click.group('items', cls=AppGroup)
+def items_cli():
+    """Bulk item import and export."""
+
+@items_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension, csv otherwise.')
+@click.option('--images', 'images_dir', type=click.Path(exists=True, file_okay=False), help='Folder the image column is relative to.')
+@click.option('--owner', help='Username for rows without an owner column.')
+@click.option('--chunk-size', type=int, help='Items per INSERT and commit.')
+@click.option('--workers', type=int, help='Image processing processes, 0 to process in this one.')
+@click.option('--defer-images', is_flag=True, help='Only store the originals and queue resizing for the image job workers.')
+def import_command(source, fmt, images_dir, owner, chunk_size, workers, defer_images):
+    """Import items from a CSV or JSON lines file."""
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    workers = current_app.config['IMPORT_WORKERS'] if workers is None else workers
+    imported, skipped = import_items(source, file_format(source.name, fmt), images_dir, owner, chunk_size, workers, defer_images,
+                                     lambda message: click.echo(message, err=True))
+    click.echo(f'Imported {imported} items, skipped {skipped}')
+
+@items_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension, csv otherwise.')
+@click.option('--images', 'images_dir', type=click.Path(file_okay=False), help='Copy the item images into this folder.')
+@click.option('--chunk-size', type=int, help='Rows fetched from the database at a time.')
+def export_command(target, fmt, images_dir, chunk_size):
+    """Export every item to a CSV or JSON lines file that import can read back."""
+    count = export_items(target, file_format(target.name, fmt), images_dir, chunk_size or current_app.config['IMPORT_CHUNK_SIZE'])
+    click.echo(f'Exported {count} items', err=True)
@@ -0,0 +1,94 @@
+import os
+
+# Folder holding run.py and site.db
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class Config:
+    # Need a secret key to protect against modifying cookies and cross site request forgery attacks
+    SECRET_KEY = os.environ.get('SECRET_KEY', '0ebb980f435eef6cfaa76b5aebbff95d')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'site.db'))
+
+    # Applied to every new SQLite connection. WAL lets readers carry on while one writer commits,
+    # busy_timeout makes writers wait for the lock instead of failing with "database is locked"
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+    # Connection pool for server databases (PostgreSQL, MySQL), SQLite ignores these
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+
+    # Number of items shown per page of the home feed
+    ITEMS_PER_PAGE = 20
+    # Most results shown for a search, a one letter search can match every item
+    SEARCH_RESULTS = 100
+
+    # How many times a booking is retried when the database is busy, and the first backoff in seconds
+    BOOKING_RETRIES = 5
+    BOOKING_RETRY_DELAY = 0.05
+
+    # Image variants, stored as WebP when Pillow supports it and JPEG otherwise
+    THUMBNAIL_SIZE = (250, 250)
+    DISPLAY_SIZE = (1024, 1024)
+    IMAGE_WEBP = True
+    IMAGE_QUALITY = 80
+    # Stored originals never change once written, so browsers and CDNs can keep them for a year
+    IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+    # Run an image worker thread inside each web process, turn off when running 'flask jobs worker' instead
+    IMAGE_JOBS_INLINE = True
+    # Attempts before a job is failed, and the delay before the first retry in seconds
+    IMAGE_JOB_RETRIES = 3
+    IMAGE_JOB_RETRY_DELAY = 30
+    # Running jobs not finished after this many seconds are assumed lost with their worker
+    IMAGE_JOB_TIMEOUT = 300
+    # Seconds an idle worker waits before checking the queue again
+    IMAGE_JOB_POLL = 5
+
+    # Rendered item lists for the home feed, search and favourites. Set PAGE_CACHE_DIR to a
+    # folder to share the rendered lists between worker processes, invalidation is always shared
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_BYTES = 32 * 1024 * 1024
+    PAGE_CACHE_TTL = 30
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+
+    # flask items import: items per INSERT and commit, and image processing processes
+    IMPORT_CHUNK_SIZE = 1000
+    IMPORT_WORKERS = os.cpu_count() or 1
+
+    # Request and SQL timing served at /metrics. Slower requests and statements are logged, as are
+    # requests that run the same statement NPLUS1_THRESHOLD or more times
+    METRICS_ENABLED = True
+    METRICS_ALLOWED = ('127.0.0.1', '::1')
+    # When set, /metrics is answered for any address that sends "Authorization: Bearer <token>".
+    # Otherwise only for METRICS_ALLOWED, and never for requests that came through a proxy
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+    SLOW_REQUEST_SECONDS = 0.5
+    SLOW_QUERY_SECONDS = 0.1
+    NPLUS1_THRESHOLD = 5
+
+    # Logged in user cache
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 30
+
+    # bcrypt cost factor, existing hashes are upgraded on the next successful login when it changes
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_THREADS = 2
+    # Hashes allowed to be running or waiting at once in a worker, and how long a request waits for a place
+    PASSWORD_HASH_QUEUE = 16
+    PASSWORD_HASH_TIMEOUT = 10
+
+
+class TestConfig(Config):
+    # Isolated in-memory database and cheap hashing for tests
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    IMAGE_JOBS_INLINE = False
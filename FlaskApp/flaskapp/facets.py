@@ -0,0 +1,149 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from flask import current_app
+from werkzeug.local import LocalProxy
+from flaskapp.forms import UploadForm
+from flaskapp.search import IncrementalIndex, add_posting, normalise
+
+# ------------- FACET INDEX ------------- #
+
+# Filters on the /items page. Every value of the fixed vocabularies keeps a bitmap of the
+# item ids that have it (a Python int with bit n set for item n), so narrowing a filter is a
+# few ANDs and a facet count is a popcount, with no GROUP BY over the Items table. Brands are
+# free text and there can be as many as items, so they keep sorted id arrays like SearchIndex
+# and are counted from the matching items instead.
+FACET_FIELDS = ('typeOfClothing', 'colour', 'size', 'brand')
+
+# The upload form only offers these values, brand is free text and grows as items arrive
+VOCABULARIES = {
+    'typeOfClothing': list(UploadForm.typeOfClothing.kwargs['choices']),
+    'colour': list(UploadForm.colour.kwargs['choices']),
+    'size': list(UploadForm.size.kwargs['choices']),
+}
+
+# Filter values are matched whatever their case, e.g. ?colour=black or ?size=xl
+SPELLINGS = {field: {value.lower(): value for value in values} for field, values in VOCABULARIES.items()}
+
+
+def ids_of(bitmap, after=0, limit=None):
+    # Item ids in a bitmap greater than after, lowest first. Scans the binary digits,
+    # clearing bits one at a time copies the whole int for every id
+    after = max(after, 0)
+    digits = bin(bitmap >> (after + 1))[:1:-1]
+    ids = []
+    pos = digits.find('1')
+    while pos != -1 and (limit is None or len(ids) < limit):
+        ids.append(after + 1 + pos)
+        pos = digits.find('1', pos + 1)
+    return ids
+
+def bitmap_of(ids):
+    # The bitmap with the bits of the given item ids set
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for item_id in ids:
+        bits[item_id >> 3] |= 1 << (item_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex(IncrementalIndex):
+
+    COLUMNS = FACET_FIELDS + ('minimumCredits',)
+
+    def _reset(self):
+        super()._reset()
+        # field -> value -> bitmap of item ids, for the fixed vocabularies
+        self.bitmaps = {field: {value: 0 for value in values} for field, values in VOCABULARIES.items()}
+        # brand -> sorted array of item ids, item id -> brand and the number of items per brand
+        self.brands = {}
+        self.brand_of = {}
+        self.brand_totals = Counter()
+        # minimumCredits -> bitmap, plus the distinct credit values in order for range lookups
+        self.credits = {}
+        self.credit_values = []
+        # Every indexed item
+        self.everything = 0
+
+    def _index(self, item_id, values):
+        *values, credits = values
+        bit = 1 << item_id
+        for field, value in zip(FACET_FIELDS, values):
+            if not value:
+                continue
+            if field in VOCABULARIES:
+                self.bitmaps[field][value] = self.bitmaps[field].get(value, 0) | bit
+            elif add_posting(self.brands.setdefault(value, array('l')), item_id):
+                self.brand_of[item_id] = value
+                self.brand_totals[value] += 1
+        if credits is not None:
+            if credits not in self.credits:
+                insort(self.credit_values, credits)
+                self.credits[credits] = 0
+            self.credits[credits] |= bit
+        self.everything |= bit
+
+    def _credit_range(self, low, high):
+        # Bitmap of items whose minimum credits fall between low and high inclusive
+        start = 0 if low is None else bisect_left(self.credit_values, low)
+        end = len(self.credit_values) if high is None else bisect_right(self.credit_values, high)
+        bitmap = 0
+        for value in self.credit_values[start:end]:
+            bitmap |= self.credits[value]
+        return bitmap
+
+    def _selected(self, field, values):
+        if field not in VOCABULARIES:
+            return bitmap_of([item_id for value in values for item_id in self.brands.get(value, ())])
+        bitmap = 0
+        for value in values:
+            bitmap |= self.bitmaps[field].get(value, 0)
+        return bitmap
+
+    def _brand_counts(self, others):
+        # Brands of the items in others, so only the ones that would return something. Proportional
+        # to the number of matching items rather than the number of brands
+        if others == self.everything:
+            return self.brand_totals
+        return Counter(self.brand_of[item_id] for item_id in ids_of(others) if item_id in self.brand_of)
+
+    def filter(self, selected, low=None, high=None):
+        # selected is field -> list of wanted values. Values of one field are OR'd, fields are AND'd.
+        # Returns the bitmap of matching items and the counts for every facet value, where each
+        # field's counts ignore that field's own selection so the user can see what switching gives
+        self.refresh()
+        with self.lock:
+            base = self.everything
+            if low is not None or high is not None:
+                base &= self._credit_range(low, high)
+            chosen = {field: self._selected(field, values) for field, values in selected.items() if values}
+
+            matches = base
+            for bitmap in chosen.values():
+                matches &= bitmap
+
+            counts = {}
+            for field in FACET_FIELDS:
+                others = base
+                for other, bitmap in chosen.items():
+                    if other != field:
+                        others &= bitmap
+                if field in VOCABULARIES:
+                    counts[field] = {value: (bitmap & others).bit_count() for value, bitmap in self.bitmaps[field].items()}
+                else:
+                    counts[field] = dict(self._brand_counts(others))
+        return matches, counts
+
+
+def parse_filters(args):
+    # Reads ?typeOfClothing=Dress&colour=Black&colour=Red&brand=zara&min_credits=5&max_credits=20
+    selected = {field: args.getlist(field) for field in FACET_FIELDS}
+    for field, spellings in SPELLINGS.items():
+        selected[field] = [spellings.get(value.strip().lower(), value) for value in selected[field] if value.strip()]
+    selected['brand'] = [normalise(brand) for brand in selected['brand'] if normalise(brand)]
+    return selected, args.get('min_credits', type=int), args.get('max_credits', type=int)
+
+
+# Each app (and so each worker process) has its own index, see create_app
+facet_index = LocalProxy(lambda: current_app.extensions['facet_index'])
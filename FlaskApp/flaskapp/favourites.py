@@ -0,0 +1,50 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from flaskapp import db
+from flaskapp.models import Items, Favourites
+from flaskapp.stats import record_favourites
+
+# ------------- FAVOURITES ------------- #
+
+# Favourites are read and written as sets of item ids: one query finds which items on a
+# page the user has favourited, and any number of favourites change in one transaction.
+
+
+def favourite_ids_query(user_id):
+    # Answered from the (userID, itemID) unique index without touching the Favourites rows
+    return db.session.query(Favourites.itemID).filter(Favourites.userID == user_id)
+
+def favourite_ids(user_id):
+    return {item_id for (item_id,) in favourite_ids_query(user_id)}
+
+def favourite_items_query(user_id):
+    # (favourite, item) pairs for the favourites page, item owners loaded in the same query
+    return db.session.query(Favourites, Items).filter(Favourites.userID == user_id).join(Items, Items.id == Favourites.itemID).options(joinedload(Items.owner))
+
+def _change(user_id, add, remove):
+    current = favourite_ids(user_id)
+    # Only items that exist can be favourited, ids already in the set are left alone
+    wanted = set(add) - current - set(remove)
+    if wanted:
+        wanted = {item_id for (item_id,) in db.session.query(Items.id).filter(Items.id.in_(wanted))}
+    dropped = set(remove) & current
+
+    if wanted:
+        db.session.bulk_insert_mappings(Favourites, [{'userID': user_id, 'itemID': item_id} for item_id in sorted(wanted)])
+        record_favourites(sorted(wanted), 1)
+    if dropped:
+        Favourites.query.filter(Favourites.userID == user_id, Favourites.itemID.in_(dropped)).delete(synchronize_session=False)
+        record_favourites(sorted(dropped), -1)
+    db.session.commit()
+    return wanted, dropped, (current | wanted) - dropped
+
+def change_favourites(user_id, add=(), remove=()):
+    # Adds and removes favourites in one transaction.
+    # Returns (ids added, ids removed, the user's favourites afterwards)
+    try:
+        return _change(user_id, add, remove)
+    except IntegrityError:
+        # The same favourite was added by another request at the same time, the unique
+        # index rejected ours, so start again from what is now stored
+        db.session.rollback()
+        return _change(user_id, add, remove)
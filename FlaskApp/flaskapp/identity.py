@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+# ------------- IDENTITY CACHE ------------- #
+
+# Flask-Login loads the logged in user on every request. The fields pages need are kept
+# here for a short time so most requests skip the Users query. Entries are dropped when
+# this process changes a user's balance or name, and expire after USER_CACHE_TTL seconds
+# so changes made by other workers show up quickly.
+
+
+class IdentityCache:
+
+    def __init__(self):
+        # user id -> (expiry time, cached fields), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, fields):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + current_app.config['USER_CACHE_TTL'], fields)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > current_app.config['USER_CACHE_SIZE']:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Each app has its own cache, see create_app
+identity_cache = LocalProxy(lambda: current_app.extensions['identity_cache'])
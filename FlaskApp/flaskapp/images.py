@@ -0,0 +1,108 @@
+import click
+import os
+from functools import lru_cache
+from flask import current_app
+from flask.cli import AppGroup
+from flaskapp.models import Items
+
+# ------------- IMAGE PIPELINE ------------- #
+
+# Every upload gets a fixed size thumbnail for the listing grids and a bounded display
+# size for the item page, so pages stop serving multi-megabyte originals at 250x250.
+
+VARIANTS = ('thumbs', 'display')
+
+
+def image_dir():
+    return os.path.join(current_app.root_path, 'static/image_pics')
+
+# Pillow is only imported when an image is actually processed, web workers that only
+# render pages never load it
+@lru_cache(maxsize=None)
+def webp_supported():
+    from PIL import features
+    return features.check('webp')
+
+def image_format(path):
+    # Pillow's name for the file's format, e.g. 'JPEG' or 'PNG', or None if it is not an image
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            return image.format
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+def variant_name(image_fn, variant):
+    # e.g. 29d518658ed30555.jpg -> thumbs/29d518658ed30555-250x250-q80.webp. The settings are
+    # part of the name, so changing them writes new files instead of replacing cached ones
+    stem, _ = os.path.splitext(os.path.basename(image_fn))
+    width, height = current_app.config['THUMBNAIL_SIZE' if variant == 'thumbs' else 'DISPLAY_SIZE']
+    ext = '.webp' if current_app.config['IMAGE_WEBP'] and webp_supported() else '.jpg'
+    return f"{variant}/{stem}-{width}x{height}-q{current_app.config['IMAGE_QUALITY']}{ext}"
+
+def _save(image, path):
+    from PIL import Image
+    if path.endswith('.jpg') and image.mode != 'RGB':
+        # JPEG has no alpha channel, put transparent images on a white background
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.convert('RGBA').split()[-1])
+        image = background
+    image.save(path, quality=current_app.config['IMAGE_QUALITY'], optimize=True)
+
+def make_variants(image_fn):
+    # Writes the thumbnail and display images next to the original
+    from PIL import Image, ImageOps
+    with Image.open(os.path.join(image_dir(), image_fn)) as original:
+        # Respect camera rotation before resizing, the variants carry no EXIF
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA')
+
+        thumb = ImageOps.fit(original, current_app.config['THUMBNAIL_SIZE'], Image.LANCZOS)
+        display = original.copy()
+        display.thumbnail(current_app.config['DISPLAY_SIZE'], Image.LANCZOS)
+
+        for variant, image in (('thumbs', thumb), ('display', display)):
+            path = os.path.join(image_dir(), variant_name(image_fn, variant))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _save(image, path)
+
+def has_variants(image_fn):
+    return all(os.path.exists(os.path.join(image_dir(), variant_name(image_fn, variant))) for variant in VARIANTS)
+
+
+# Templates use {{ url_for('static', filename='image_pics/' + item.image_file|thumbnail) }}
+# and fall back to the original when an image has not been processed yet, registered in create_app
+def thumbnail_filter(image_fn):
+    name = variant_name(image_fn, 'thumbs')
+    return name if os.path.exists(os.path.join(image_dir(), name)) else image_fn
+
+def display_filter(image_fn):
+    name = variant_name(image_fn, 'display')
+    return name if os.path.exists(os.path.join(image_dir(), name)) else image_fn
+
+
+# ------------- CLI ------------- #
+
+@click.group(cls=AppGroup)
+def images():
+    """Item image processing."""
+
+@images.command('backfill')
+@click.option('--force', is_flag=True, help='Regenerate variants that already exist.')
+def backfill_command(force):
+    """Create thumbnails and display images for items uploaded before the pipeline."""
+    done = skipped = failed = 0
+    for (image_fn,) in Items.query.with_entities(Items.image_file).distinct():
+        if not force and has_variants(image_fn):
+            skipped += 1
+            continue
+        try:
+            make_variants(image_fn)
+            done += 1
+        except (OSError, ValueError) as error:
+            # Missing or unreadable originals keep showing the original path
+            click.echo(f'{image_fn}: {error}', err=True)
+            failed += 1
+    click.echo(f'Processed {done} images, {skipped} already done, {failed} failed')
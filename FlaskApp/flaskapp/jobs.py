@@ -0,0 +1,150 @@
+import click
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import AppGroup
+from flaskapp import db
+from flaskapp.models import Items, ImageJobs
+from flaskapp.images import make_variants, has_variants
+from flaskapp.pagecache import page_cache
+
+# ------------- IMAGE JOBS ------------- #
+
+# Uploads only store the original and queue a job in the ImageJobs table, so image work
+# happens off the request path. Any process sharing the database can run the jobs.
+
+
+def enqueue(item):
+    # Added to the caller's transaction, so the job exists exactly when the item does
+    item.image_status = 'pending'
+    db.session.add(ImageJobs(itemID=item.id))
+
+def process_image(image_fn):
+    # Everything slow about an upload goes here, returns the image file the item should use.
+    # Identical uploads share a file, so their variants may already exist.
+    if not has_variants(image_fn):
+        make_variants(image_fn)
+    return image_fn
+
+def due_jobs_query(now):
+    return ImageJobs.query.filter(ImageJobs.status == 'queued', ImageJobs.runAfter <= now).order_by(ImageJobs.id)
+
+def claim():
+    # Takes the oldest due job, the status guard stops two workers claiming the same one
+    now = datetime.utcnow()
+    ImageJobs.query.filter(ImageJobs.status == 'running', ImageJobs.updated < now - timedelta(seconds=current_app.config['IMAGE_JOB_TIMEOUT'])).update(
+        {ImageJobs.status: 'queued'}, synchronize_session=False)
+    db.session.commit()
+
+    while True:
+        job = due_jobs_query(now).first()
+        if job is None:
+            return None
+        claimed = ImageJobs.query.filter(ImageJobs.id == job.id, ImageJobs.status == 'queued').update(
+            {ImageJobs.status: 'running', ImageJobs.attempts: ImageJobs.attempts + 1, ImageJobs.updated: now}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return job.id
+
+def run_job(job_id):
+    job = ImageJobs.query.get(job_id)
+    item = Items.query.get(job.itemID)
+    try:
+        image_fn = process_image(item.image_file)
+    except Exception as error:
+        db.session.rollback()
+        job.error = str(error)[:200]
+        if job.attempts >= current_app.config['IMAGE_JOB_RETRIES']:
+            job.status = 'failed'
+            item.image_status = 'failed'
+        else:
+            # Back off exponentially before the next attempt
+            job.status = 'queued'
+            job.runAfter = datetime.utcnow() + timedelta(seconds=current_app.config['IMAGE_JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1))
+    else:
+        job.status = 'done'
+        job.error = None
+        item.image_file = image_fn
+        item.image_status = 'ready'
+    job.updated = datetime.utcnow()
+    db.session.commit()
+    # Pages showing the placeholder need the finished image
+    page_cache.invalidate()
+    return job.status
+
+def drain():
+    # Runs due jobs until the queue is empty, returns how many were run
+    count = 0
+    while True:
+        job_id = claim()
+        if job_id is None:
+            return count
+        run_job(job_id)
+        count += 1
+
+
+# ------------- INLINE WORKER ------------- #
+
+# One daemon thread per app in each web process, started on the first upload so it is
+# created after any pre-fork and never in a process that does not take uploads
+_worker_lock = threading.Lock()
+
+def _inline_worker(flask_app, wakeup):
+    while True:
+        wakeup.wait(flask_app.config['IMAGE_JOB_POLL'])
+        wakeup.clear()
+        with flask_app.app_context():
+            try:
+                drain()
+            except Exception:
+                flask_app.logger.exception('Image job worker failed')
+            finally:
+                db.session.remove()
+
+def notify():
+    # Called after the upload commits so the job is visible to the worker
+    flask_app = current_app._get_current_object()
+    if not flask_app.config['IMAGE_JOBS_INLINE']:
+        return
+    with _worker_lock:
+        state = flask_app.extensions.setdefault('image_jobs', {'wakeup': threading.Event(), 'worker': None})
+        if state['worker'] is None or not state['worker'].is_alive():
+            state['worker'] = threading.Thread(target=_inline_worker, args=(flask_app, state['wakeup']), name='image-jobs', daemon=True)
+            state['worker'].start()
+    state['wakeup'].set()
+
+
+# ------------- CLI ------------- #
+
+@click.group(cls=AppGroup)
+def jobs():
+    """Background image processing jobs."""
+
+@jobs.command('worker')
+@click.option('--threads', default=2, help='Jobs processed at the same time.')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty instead of polling.')
+def worker_command(threads, once):
+    """Process queued image jobs."""
+    flask_app = current_app._get_current_object()
+
+    def loop():
+        with flask_app.app_context():
+            while True:
+                drain()
+                if once:
+                    break
+                time.sleep(flask_app.config['IMAGE_JOB_POLL'])
+            db.session.remove()
+
+    with ThreadPoolExecutor(threads) as pool:
+        for future in [pool.submit(loop) for _ in range(threads)]:
+            future.result()
+
+@jobs.command('status')
+def status_command():
+    """Show how many jobs are in each state."""
+    counts = db.session.query(ImageJobs.status, db.func.count(ImageJobs.id)).group_by(ImageJobs.status).all()
+    for status, count in counts:
+        click.echo(f'{status}: {count}')
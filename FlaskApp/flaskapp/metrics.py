@@ -0,0 +1,214 @@
+import hmac
+import threading
+import time
+from collections import Counter
+from flask import current_app, g, request, has_request_context, abort
+from sqlalchemy import event
+from flaskapp import db
+
+# ------------- METRICS ------------- #
+
+# Timing for every request and the SQL it runs, recorded with SQLAlchemy engine events.
+# Slow requests, slow statements and statements repeated many times in one request (the
+# usual sign of an N+1 query loop) are logged, and everything is served at /metrics in
+# the Prometheus text format. Figures are per worker process.
+
+
+class Metrics:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # (endpoint, status) -> count
+        self.requests = Counter()
+        # endpoint -> [count per bucket..., +Inf count], total seconds
+        self.histograms = {}
+        self.request_seconds = Counter()
+        # endpoint -> statements and seconds, None for work outside requests (image jobs, CLI)
+        self.statements = Counter()
+        self.sql_seconds = Counter()
+        self.slow_requests = Counter()
+        self.slow_queries = 0
+        self.repeated = Counter()
+
+    def record_request(self, endpoint, status, seconds, statements, sql_seconds):
+        with self.lock:
+            self.requests[endpoint, status] += 1
+            counts = self.histograms.setdefault(endpoint, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.request_seconds[endpoint] += seconds
+            self.statements[endpoint] += statements
+            self.sql_seconds[endpoint] += sql_seconds
+
+    def record_statement(self, seconds):
+        # Statements run outside a request
+        with self.lock:
+            self.statements[None] += 1
+            self.sql_seconds[None] += seconds
+
+    def record_slow_request(self, endpoint):
+        with self.lock:
+            self.slow_requests[endpoint] += 1
+
+    def record_slow_query(self):
+        with self.lock:
+            self.slow_queries += 1
+
+    def record_repeated(self, endpoint):
+        with self.lock:
+            self.repeated[endpoint] += 1
+
+    def render(self, extra):
+        # Prometheus text exposition format. extra is {name: (type, help, value)} for gauges
+        # and counters from the caches
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{label_text(labels)} {value}')
+
+        with self.lock:
+            family('flaskapp_requests_total', 'counter', 'Requests handled.',
+                   [((('endpoint', endpoint), ('status', status)), count) for (endpoint, status), count in sorted(self.requests.items())])
+
+            lines.append('# HELP flaskapp_request_duration_seconds Time spent handling requests.')
+            lines.append('# TYPE flaskapp_request_duration_seconds histogram')
+            for endpoint, counts in sorted(self.histograms.items()):
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    le = bound if bound == '+Inf' else repr(float(bound))
+                    lines.append(f"flaskapp_request_duration_seconds_bucket{label_text([('endpoint', endpoint), ('le', le)])} {count}")
+                lines.append(f"flaskapp_request_duration_seconds_sum{label_text([('endpoint', endpoint)])} {self.request_seconds[endpoint]}")
+                lines.append(f"flaskapp_request_duration_seconds_count{label_text([('endpoint', endpoint)])} {counts[-1]}")
+
+            def by_endpoint(counter):
+                return [((('endpoint', endpoint or 'none'),), value) for endpoint, value in sorted(counter.items(), key=lambda kv: kv[0] or '')]
+
+            family('flaskapp_sql_statements_total', 'counter', 'SQL statements executed.', by_endpoint(self.statements))
+            family('flaskapp_sql_duration_seconds_total', 'counter', 'Time spent executing SQL statements.', by_endpoint(self.sql_seconds))
+            family('flaskapp_slow_requests_total', 'counter', 'Requests slower than SLOW_REQUEST_SECONDS.', by_endpoint(self.slow_requests))
+            family('flaskapp_slow_queries_total', 'counter', 'SQL statements slower than SLOW_QUERY_SECONDS.', [((), self.slow_queries)])
+            family('flaskapp_repeated_statements_total', 'counter', 'Requests that ran one statement at least NPLUS1_THRESHOLD times.', by_endpoint(self.repeated))
+
+        for name, (kind, help_text, value) in extra.items():
+            family(name, kind, help_text, [((), value)])
+        return '\n'.join(lines) + '\n'
+
+
+def label_text(labels):
+    # {key="value",...}, or nothing for a metric without labels
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+# ------------- HOOKS ------------- #
+
+def instrument(app):
+    # Called from create_app once the engine exists
+    metrics = Metrics(app.config['METRICS_BUCKETS'])
+    app.extensions['metrics'] = metrics
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if elapsed > app.config['SLOW_QUERY_SECONDS']:
+            metrics.record_slow_query()
+            app.logger.warning('Slow query (%.3fs): %s', elapsed, statement)
+        sql = g.get('sql') if has_request_context() else None
+        if sql is None:
+            metrics.record_statement(elapsed)
+            return
+        sql['count'] += 1
+        sql['seconds'] += elapsed
+        sql['statements'][statement] += 1
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_statement(context):
+        # after_cursor_execute does not run for a statement that fails, drop its start time here
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started and context.execution_context is not None:
+            started.pop()
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.sql = {'count': 0, 'seconds': 0.0, 'statements': Counter()}
+
+    @app.after_request
+    def end_request(response):
+        started = g.get('request_started')
+        sql = g.get('sql')
+        if started is None or sql is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'none'
+        metrics.record_request(endpoint, response.status_code, elapsed, sql['count'], sql['seconds'])
+
+        if elapsed > app.config['SLOW_REQUEST_SECONDS']:
+            metrics.record_slow_request(endpoint)
+            app.logger.warning('Slow request (%.3fs, %d statements, %.3fs in SQL): %s %s',
+                               elapsed, sql['count'], sql['seconds'], request.method, request.full_path)
+
+        # The same statement again and again in one request is normally a query inside a loop
+        for statement, count in sql['statements'].items():
+            if count >= app.config['NPLUS1_THRESHOLD']:
+                metrics.record_repeated(endpoint)
+                app.logger.warning('Possible N+1 in %s: statement ran %d times: %s', endpoint, count, statement)
+
+        # Shows up in the browser's network tab
+        response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}, db;dur={sql['seconds'] * 1000:.1f};desc=\"{sql['count']} statements\""
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def metrics_allowed():
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    # Behind a reverse proxy on the same machine every request comes from 127.0.0.1, the
+    # forwarding headers show it was really someone else
+    if 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers:
+        return False
+    return request.remote_addr in current_app.config['METRICS_ALLOWED']
+
+def metrics_view():
+    # Only answered for METRICS_TOKEN holders, or addresses in METRICS_ALLOWED (by default the local machine)
+    if not metrics_allowed():
+        abort(404)
+
+    from flaskapp.identity import identity_cache
+    from flaskapp.pagecache import page_cache
+    from flaskapp.passwords import password_hasher
+    users = identity_cache.stats()
+    pages = page_cache.stats()
+    hashes = password_hasher.stats()
+    extra = {
+        'flaskapp_user_cache_hits_total': ('counter', 'Logged in user cache hits.', users['hits']),
+        'flaskapp_user_cache_misses_total': ('counter', 'Logged in user cache misses.', users['misses']),
+        'flaskapp_user_cache_entries': ('gauge', 'Users in the logged in user cache.', users['size']),
+        'flaskapp_page_cache_hits_total': ('counter', 'Rendered item lists served from the page cache.', pages['hits']),
+        'flaskapp_page_cache_misses_total': ('counter', 'Rendered item lists that had to be rendered.', pages['misses']),
+        'flaskapp_page_cache_entries': ('gauge', 'Entries in the page cache.', pages['entries']),
+        'flaskapp_page_cache_bytes': ('gauge', 'Size of the page cache.', pages['bytes']),
+        'flaskapp_password_hash_queue_depth': ('gauge', 'Password hashes running or waiting.', hashes['queue_depth']),
+        'flaskapp_password_hashes_total': ('counter', 'Password hashes and checks done.', hashes['hashes']),
+        'flaskapp_password_hash_seconds_total': ('counter', 'Time spent hashing passwords.', hashes['seconds']),
+        'flaskapp_password_hash_slowest_seconds': ('gauge', 'Slowest password hash.', hashes['slowest']),
+        'flaskapp_startup_seconds': ('gauge', 'Time taken to build and warm the app.', current_app.extensions['startup'].report()['total']),
+    }
+    body = current_app.extensions['metrics'].render(extra)
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,152 @@
+import click
+import importlib
+import pkgutil
+from datetime import datetime
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from flaskapp import db
+
+# ------------- MIGRATIONS ------------- #
+
+# Each migration is a module in this package named mNNNN_description.py with an
+# upgrade(connection) function. They run in name order, each in its own transaction,
+# and applied ids are recorded in the schema_migrations table. m0001 creates any
+# missing tables straight from the models, so later migrations must check before
+# they change anything: on a new database the tables already have the latest schema.
+
+def all_migrations():
+    names = sorted(module.name for module in pkgutil.iter_modules(__path__) if module.name.startswith('m'))
+    return [(name, importlib.import_module(f'{__name__}.{name}')) for name in names]
+
+def applied_migrations(connection):
+    connection.execute(text('CREATE TABLE IF NOT EXISTS schema_migrations (id VARCHAR(64) PRIMARY KEY, applied TIMESTAMP NOT NULL)'))
+    return {row[0] for row in connection.execute(text('SELECT id FROM schema_migrations'))}
+
+class PendingMigrations(RuntimeError):
+    pass
+
+
+def pending_migrations():
+    with db.engine.begin() as connection:
+        done = applied_migrations(connection)
+    return [name for name, _ in all_migrations() if name not in done]
+
+def check_current():
+    # The app's queries assume the latest schema, refuse to serve an older database
+    waiting = pending_migrations()
+    if waiting:
+        raise PendingMigrations(f"The database needs migrating, run 'flask db upgrade' first (pending: {', '.join(waiting)})")
+
+def upgrade():
+    # Applies pending migrations, returns their ids
+    with db.engine.begin() as connection:
+        done = applied_migrations(connection)
+
+    ran = []
+    for name, module in all_migrations():
+        if name in done:
+            continue
+        with db.engine.begin() as connection:
+            module.upgrade(connection)
+            connection.execute(text('INSERT INTO schema_migrations (id, applied) VALUES (:id, :applied)'), {'id': name, 'applied': datetime.utcnow()})
+        ran.append(name)
+    return ran
+
+
+# Helpers for migrations
+
+def has_column(connection, table, column):
+    return column in {c['name'] for c in inspect(connection).get_columns(table)}
+
+def create_missing_indexes(connection, model):
+    # Creates the indexes declared on a model that the table does not have yet
+    existing = {index['name'] for index in inspect(connection).get_indexes(model.__tablename__)}
+    for index in model.__table__.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+# ------------- QUERY PLANS ------------- #
+
+def hot_queries():
+    # The lookups on hot paths, built by the same functions the app runs them with, so the
+    # checked SQL cannot drift from the real one. Each must be answered from an index, never
+    # a full table scan. Needs an app context
+    from datetime import datetime
+    from flaskapp.availability import overlapping, bookings_query
+    from flaskapp.facets import FacetIndex
+    from flaskapp.favourites import favourite_ids_query, favourite_items_query
+    from flaskapp.jobs import due_jobs_query
+    from flaskapp.routes import feed_query, item_rows_query
+    from flaskapp.search import SearchIndex, items_query
+    from flaskapp.stats import rentals_query, favourite_count_query, window_start
+    today = datetime.today().date()
+    return [
+        ('search index refresh', SearchIndex().new_rows_query()),
+        ('facet index refresh', FacetIndex().new_rows_query()),
+        ('search results', items_query([1, 2, 3])),
+        ('home feed page', feed_query(20, 0, None)),
+        ('home feed previous page', feed_query(20, None, 100)),
+        ('items page', item_rows_query([1, 2, 3])),
+        ('rental overlap', db.session.query(overlapping(1, today, today).exists())),
+        ('next free dates', bookings_query(1, today)),
+        ('rented days', rentals_query(1, window_start())),
+        ('favourite count', favourite_count_query(1)),
+        ('favourite ids', favourite_ids_query(1)),
+        ('favourites page', favourite_items_query(1)),
+        ('image job claim', due_jobs_query(datetime.utcnow()).limit(1)),
+    ]
+
+def compiled_sql(query, dialect):
+    # The SQL the query sends, with its parameters written in
+    statement = getattr(query, 'statement', query)
+    return str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+def full_scans(connection):
+    # Returns (query, plan line) for every hot query that scans a whole table
+    problems = []
+    queries = hot_queries()
+    for name, query in queries:
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + compiled_sql(query, connection.dialect)):
+            detail = row[-1]
+            # "SEARCH t USING INDEX" is a lookup, "SCAN t" reads every row. An EXISTS
+            # wrapper shows up as "SCAN CONSTANT ROW", which reads nothing
+            if detail.startswith('SCAN') and detail != 'SCAN CONSTANT ROW':
+                problems.append((name, detail))
+    return problems, len(queries)
+
+
+# ------------- CLI ------------- #
+
+@click.group('db', cls=AppGroup)
+def db_cli():
+    """Database schema migrations."""
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending migrations."""
+    ran = upgrade()
+    for name in ran:
+        click.echo(f'Applied {name}')
+    click.echo(f'{len(ran)} migrations applied' if ran else 'Database is up to date')
+
+@db_cli.command('current')
+def current_command():
+    """List migrations and whether they have been applied."""
+    with db.engine.begin() as connection:
+        done = applied_migrations(connection)
+    for name, _ in all_migrations():
+        click.echo(f"{'applied' if name in done else 'pending'}  {name}")
+
+@db_cli.command('check-plans')
+def check_plans_command():
+    """Fail if a hot query would scan a whole table."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Query plan checks read SQLite EXPLAIN QUERY PLAN output')
+    with db.engine.connect() as connection:
+        problems, checked = full_scans(connection)
+    for name, detail in problems:
+        click.echo(f'{name}: {detail}', err=True)
+    if problems:
+        raise click.ClickException(f'{len(problems)} hot queries fall back to a full scan')
+    click.echo(f'All {checked} hot queries use an index')
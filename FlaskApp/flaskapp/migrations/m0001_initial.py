@@ -0,0 +1,7 @@
+from flaskapp import db
+import flaskapp.models # registers every table on db.metadata
+
+
+def upgrade(connection):
+    # A new database gets every table at the latest schema, an existing one only the tables it is missing
+    db.metadata.create_all(connection)
@@ -0,0 +1,14 @@
+from sqlalchemy import text
+from flaskapp.migrations import has_column
+
+
+def upgrade(connection):
+    # Background image processing tracks each item's image state
+    if not has_column(connection, 'Items', 'image_status'):
+        connection.execute(text('ALTER TABLE "Items" ADD COLUMN image_status VARCHAR(8) NOT NULL DEFAULT \'ready\''))
+
+    # Content addressed file names are longer than the old random ones. SQLite does not enforce lengths.
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ALTER TABLE "Items" ALTER COLUMN image_file TYPE VARCHAR(64)'))
+    elif connection.dialect.name == 'mysql':
+        connection.execute(text('ALTER TABLE Items MODIFY image_file VARCHAR(64) NOT NULL'))
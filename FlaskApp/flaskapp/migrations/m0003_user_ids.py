@@ -0,0 +1,19 @@
+import click
+from sqlalchemy import text
+
+
+def upgrade(connection):
+    # Items.userID and Rentals.userID used to be written with usernames, which SQLite accepts
+    # in an Integer column. Swap them for the user's id so the foreign key and its index work.
+    # Server databases reject text in an integer column, so only SQLite can hold such rows.
+    if connection.dialect.name != 'sqlite':
+        return
+
+    for table in ('Items', 'Rentals'):
+        connection.execute(text(f'''
+            UPDATE "{table}" SET "userID" = (SELECT "Users".id FROM "Users" WHERE "Users".username = "{table}"."userID")
+            WHERE typeof("userID") = 'text' AND "userID" IN (SELECT username FROM "Users")'''))
+
+        orphans = connection.execute(text(f'SELECT count(*) FROM "{table}" WHERE typeof("userID") != \'integer\'')).scalar()
+        if orphans:
+            click.echo(f'{table}: {orphans} rows name a user that does not exist and were left unchanged', err=True)
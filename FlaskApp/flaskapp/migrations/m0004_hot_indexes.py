@@ -0,0 +1,14 @@
+from sqlalchemy import text
+from flaskapp.migrations import create_missing_indexes
+from flaskapp.models import Items, Rentals, Favourites, ImageJobs
+
+
+def upgrade(connection):
+    # The unique (userID, itemID) index needs duplicate favourites gone first, keep the oldest of each.
+    # Run 'flask stats recompute' afterwards if any were removed.
+    connection.execute(text('''
+        DELETE FROM "Favourites" WHERE id NOT IN (
+            SELECT min_id FROM (SELECT min(id) AS min_id FROM "Favourites" GROUP BY "userID", "itemID") AS keep)'''))
+
+    for model in (Items, Rentals, Favourites, ImageJobs):
+        create_missing_indexes(connection, model)
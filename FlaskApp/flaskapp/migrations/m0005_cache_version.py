@@ -0,0 +1,9 @@
+from sqlalchemy import text
+from flaskapp.models import CacheVersion
+
+
+def upgrade(connection):
+    # Shared page cache version, see pagecache.py
+    CacheVersion.__table__.create(connection, checkfirst=True)
+    if connection.execute(text('SELECT count(*) FROM "CacheVersion" WHERE id = 1')).scalar() == 0:
+        connection.execute(text('INSERT INTO "CacheVersion" (id, version) VALUES (1, 0)'))
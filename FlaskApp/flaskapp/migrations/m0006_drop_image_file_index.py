@@ -0,0 +1,11 @@
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    # Nothing looks items up by image any more, images gc reads every row, so the index only slowed writes
+    if 'ix_Items_image_file' not in {index['name'] for index in inspect(connection).get_indexes('Items')}:
+        return
+    if connection.dialect.name in ('mysql', 'mariadb'):
+        connection.execute(text('DROP INDEX ix_Items_image_file ON Items'))
+    else:
+        connection.execute(text('DROP INDEX "ix_Items_image_file"'))
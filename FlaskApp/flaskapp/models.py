@@ -1,11 +1,27 @@
 from flask import Flask
 from datetime import datetime
-from flaskapp import db, app, login_manager
+from flaskapp import db, login_manager
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached
+from flaskapp.identity import identity_cache
+
+# Fields of the logged in user kept in the identity cache, the password hash is never cached
+CACHED_USER_FIELDS = ('id', 'username', 'credit_balance')
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Users.query.get(int(user_id))
+    user_id = int(user_id)
+    fields = identity_cache.get(user_id)
+    if fields is not None:
+        # Rebuild a detached user from the cache instead of querying Users
+        user = Users(**fields)
+        make_transient_to_detached(user)
+        return user
+
+    user = Users.query.get(user_id)
+    if user is not None:
+        identity_cache.put(user_id, {field: getattr(user, field) for field in CACHED_USER_FIELDS})
+    return user
 
 #with app.app_context():
 class Users(db.Model, UserMixin):
@@ -29,10 +45,21 @@ class Users(db.Model, UserMixin):
 class Items(db.Model):
 
     __tablename__ = 'Items'
+    # Search and facet filters and the owner's listings, see migrations
+    __table_args__ = (
+        db.Index('ix_Items_colour', 'colour'),
+        db.Index('ix_Items_brand', 'brand'),
+        db.Index('ix_Items_typeOfClothing', 'typeOfClothing'),
+        db.Index('ix_Items_userID', 'userID'),
+    )
 
     id = db.Column(db.Integer, unique=True, primary_key=True)
     userID = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
-    image_file = db.Column(db.String(16), nullable=False, default='default.png')
+    owner = db.relationship('Users', lazy=True)
+    # Images are stored under a hash of their contents, see storage.py
+    image_file = db.Column(db.String(64), nullable=False, default='default.png')
+    # 'pending' while the uploaded image is processed in the background, then 'ready' or 'failed'
+    image_status = db.Column(db.String(8), nullable=False, default='ready')
     brand = db.Column(db.String(20), default='n/a')
     colour = db.Column(db.String(20))
     typeOfClothing = db.Column(db.String(50))
@@ -47,6 +74,11 @@ class Items(db.Model):
 class Rentals(db.Model):
 
     __tablename__ = 'Rentals'
+    # Availability checks look up an item's rentals by date range
+    __table_args__ = (
+        db.Index('ix_Rentals_itemID_startDate_endDate', 'itemID', 'startDate', 'endDate'),
+        db.Index('ix_Rentals_userID', 'userID'),
+    )
 
     id = db.Column(db.Integer, unique=True, primary_key=True)
     userID = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
@@ -62,6 +94,11 @@ class Rentals(db.Model):
 class Favourites(db.Model):
 
     __tablename__ = 'Favourites'
+    # A user can favourite an item once, the unique index also serves lookups by userID
+    __table_args__ = (
+        db.Index('uq_Favourites_userID_itemID', 'userID', 'itemID', unique=True),
+        db.Index('ix_Favourites_itemID', 'itemID'),
+    )
 
     id = db.Column(db.Integer, unique=True, primary_key=True)
     userID = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
@@ -72,6 +109,51 @@ class Favourites(db.Model):
 
     #db.create_all()
 
+
+class ItemStats(db.Model):
+
+    __tablename__ = 'ItemStats'
+
+    # One row per item, kept up to date as rentals and favourites are written
+    itemID = db.Column(db.Integer, db.ForeignKey('Items.id'), primary_key=True)
+    # Days rented for rentals starting on or after windowStart (6 months before the last recompute)
+    daysRented = db.Column(db.Integer, nullable=False, default=0)
+    favourites = db.Column(db.Integer, nullable=False, default=0)
+    windowStart = db.Column(db.Date, nullable=False)
+
+    def __repr__(self):
+        return f"ItemStats('{self.itemID}', '{self.daysRented}', '{self.favourites}', '{self.windowStart}')"
+
+
+class ImageJobs(db.Model):
+
+    __tablename__ = 'ImageJobs'
+    # Workers poll for the oldest queued job that is due
+    __table_args__ = (db.Index('ix_ImageJobs_status_runAfter', 'status', 'runAfter'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    itemID = db.Column(db.Integer, db.ForeignKey('Items.id'), nullable=False)
+    # queued -> running -> done, or back to queued until the retries run out and it is failed
+    status = db.Column(db.String(8), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    runAfter = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    error = db.Column(db.String(200))
+
+    def __repr__(self):
+        return f"ImageJobs('{self.itemID}', '{self.status}', '{self.attempts}')"
+
+class CacheVersion(db.Model):
+
+    __tablename__ = 'CacheVersion'
+
+    # A single row (id 1) bumped by every write that changes what the cached pages show, see pagecache.py
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"CacheVersion('{self.version}')"
+
 #with app.app_context():
     #db.create_all()
 # from flaskapp import db, app
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, session, g, has_request_context
+from werkzeug.local import LocalProxy
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from flaskapp import db
+from flaskapp.models import CacheVersion
+
+# ------------- PAGE CACHE ------------- #
+
+# Rendered item lists for the home feed, search results and favourites, keyed on the page,
+# its arguments and the catalogue version. Writes that change what these pages show bump
+# the version, so old entries are never read again and age out of the LRU. The version is
+# a row in the database, so a bump from any web worker, 'flask jobs worker' or
+# 'flask items import' reaches every process. Entries also expire after PAGE_CACHE_TTL seconds.
+
+
+class MemoryBackend:
+
+    def __init__(self, max_bytes):
+        # key -> (expiry time, html), least recently used first
+        self.entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, html, ttl):
+        cost = len(html.encode('utf-8'))
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + ttl, html)
+            self.size += cost
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        _, html = self.entries.pop(key)
+        self.size -= len(html.encode('utf-8'))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size}
+
+
+class FileBackend:
+    # Shared by every worker pointing at the same folder, so a fragment is rendered once for all of
+    # them. Entries are stored as JSON [expiry, html], never unpickled, as anything able to write
+    # to the folder could otherwise run code in the workers
+
+    # Fraction of max_bytes written by this process between two prunes of the folder
+    PRUNE_EVERY = 0.1
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.written = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._file(key), encoding='utf-8') as f:
+                expiry, html = json.load(f)
+        except (OSError, ValueError, TypeError):
+            return None
+        if not isinstance(html, str) or expiry < time.time():
+            return None
+        # Reading touches the file so pruning removes the least recently used first
+        try:
+            os.utime(self._file(key))
+        except OSError:
+            pass
+        return html
+
+    def put(self, key, html, ttl):
+        cost = len(html.encode('utf-8'))
+        if cost > self.max_bytes:
+            return
+        # Written under a temporary name and renamed so readers never see half a file
+        target = self._file(key)
+        temp = f'{target}.{os.getpid()}.{threading.get_ident()}'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump([time.time() + ttl, html], f)
+        os.replace(temp, target)
+        # Scanning the folder costs a stat per entry, so it only happens once enough has been written
+        with self.lock:
+            self.written += cost
+            if self.written < self.max_bytes * self.PRUNE_EVERY:
+                return
+            self.written = 0
+        self._prune()
+
+    def _prune(self):
+        with self.lock:
+            files = [entry for entry in os.scandir(self.path) if entry.name.endswith('.cache')]
+            size = sum(entry.stat().st_size for entry in files)
+            for entry in sorted(files, key=lambda entry: entry.stat().st_mtime_ns):
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                size -= entry.stat().st_size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.cache'):
+                os.remove(entry.path)
+
+    def stats(self):
+        files = [entry for entry in os.scandir(self.path) if entry.name.endswith('.cache')]
+        return {'entries': len(files), 'bytes': sum(entry.stat().st_size for entry in files)}
+
+
+class PageCache:
+
+    def __init__(self, config):
+        if config['PAGE_CACHE_DIR']:
+            self.backend = FileBackend(config['PAGE_CACHE_DIR'], config['PAGE_CACHE_BYTES'])
+        else:
+            self.backend = MemoryBackend(config['PAGE_CACHE_BYTES'])
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        # Read once per request, a missing row (new database) counts as version 0
+        if has_request_context() and 'page_version' in g:
+            return g.page_version
+        version = db.session.execute(select(CacheVersion.version).where(CacheVersion.id == 1)).scalar() or 0
+        if has_request_context():
+            g.page_version = version
+        return version
+
+    def invalidate(self):
+        # Called after a write that changes the catalogue, favourites or images has committed
+        g.pop('page_version', None)
+        if db.session.execute(update(CacheVersion).where(CacheVersion.id == 1).values(version=CacheVersion.version + 1)).rowcount:
+            db.session.commit()
+            return
+        try:
+            db.session.add(CacheVersion(id=1, version=1))
+            db.session.commit()
+        except IntegrityError:
+            # Another process created the row first, bump that one
+            db.session.rollback()
+            db.session.execute(update(CacheVersion).where(CacheVersion.id == 1).values(version=CacheVersion.version + 1))
+            db.session.commit()
+
+    def fragment(self, key, render):
+        # Returns the cached html for key, or calls render() and caches what it returns
+        if not current_app.config['PAGE_CACHE_ENABLED']:
+            return render()
+        key = (self.version(),) + tuple(key)
+        html = self.backend.get(key)
+        with self.lock:
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if html is None:
+            html = render()
+            self.backend.put(key, html, current_app.config['PAGE_CACHE_TTL'])
+        return html
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.backend.stats(), hits=self.hits, misses=self.misses)
+
+
+# Each app has its own cache, see create_app
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+# ------------- ETAGS ------------- #
+
+# A page is the same as last time when the catalogue version, the url and what the layout
+# shows about the visitor are. That is known before anything is queried or rendered, so a
+# repeat visit can be answered with an empty 304.
+
+def page_etag(user):
+    # The TTL bucket bounds how long a page can be reused for changes that do not bump the
+    # version, e.g. a balance changed by another worker while this one still caches the user
+    parts = [page_cache.version(), int(time.time() // max(current_app.config['PAGE_CACHE_TTL'], 1)), request.full_path]
+    if user.is_authenticated:
+        parts += [user.id, user.username, user.credit_balance]
+    # The search form carries a CSRF token that expires, so pages are only reused within half its lifetime
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    parts += [session.get('csrf_token'), int(time.time() // max(limit // 2, 1))]
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def not_modified(etag):
+    # Pages with flash messages waiting must be rendered so the messages are shown
+    if not current_app.config['PAGE_CACHE_ENABLED'] or session.get('_flashes'):
+        return None
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return None
+
+def with_etag(response, etag):
+    # The browser keeps the page but checks back with the ETag every time it is shown
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
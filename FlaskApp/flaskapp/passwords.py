@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.local import LocalProxy
+from flaskapp import db, bcrypt
+
+# ------------- PASSWORD HASHING ------------- #
+
+# bcrypt is deliberately slow and CPU bound. Hashes run on a small thread pool per worker
+# (bcrypt releases the GIL) so a burst of logins cannot take every CPU away from other
+# requests, and callers beyond PASSWORD_HASH_QUEUE give up instead of piling up.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+
+    def __init__(self):
+        self.executor = None
+        self.slots = None
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def _start(self):
+        # Created lazily so pre-forked workers each get their own threads
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(current_app.config['PASSWORD_HASH_THREADS'], thread_name_prefix='bcrypt')
+                self.slots = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_QUEUE'])
+
+    def _timed(self, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.count += 1
+                self.seconds += elapsed
+                self.slowest = max(self.slowest, elapsed)
+
+    def run(self, function, *args):
+        self._start()
+        if not self.slots.acquire(timeout=current_app.config['PASSWORD_HASH_TIMEOUT']):
+            raise HashingBusy()
+        with self.lock:
+            self.depth += 1
+        try:
+            return self.executor.submit(self._timed, function, *args).result()
+        finally:
+            with self.lock:
+                self.depth -= 1
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {'queue_depth': self.depth, 'hashes': self.count, 'seconds': self.seconds, 'slowest': self.slowest}
+
+
+# Each app (and so each worker process) has its own threads and figures, see create_app
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+
+
+def hash_password(password):
+    rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+    return password_hasher.run(bcrypt.generate_password_hash, password, rounds).decode('utf-8') # Makes it a string
+
+def needs_rehash(pw_hash):
+    # bcrypt hashes look like $2b$12$..., the number is the cost they were made with
+    try:
+        return int(pw_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
+
+def check_password(user, password):
+    # Verifies the password and upgrades the stored hash if the cost factor has changed
+    if not password_hasher.run(bcrypt.check_password_hash, user.password, password):
+        return False
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.session.commit()
+    return True
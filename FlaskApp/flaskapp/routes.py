@@ -1,113 +1,148 @@
-import os
-import secrets
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from flask import render_template, url_for, flash, redirect # functions for web rendering and redirects
-from flaskapp import app, db , bcrypt # flask app instance, database and password hashing
+from flask import Blueprint, current_app, render_template, url_for, flash, redirect, request, jsonify, make_response # functions for web rendering and redirects
+from flaskapp import db # database
 from flaskapp.forms import SignupForm, LoginForm, UploadForm, ItemRental, SearchForm # form classes
-from flaskapp.models import Users, Items, Rentals, Favourites # database models
+from flaskapp.models import Users, Items # database models
+from flaskapp.search import search_index, normalise # in-memory inverted index for the search bar
+from flaskapp.facets import facet_index, parse_filters, ids_of # in-memory bitmaps for filtering
+from flaskapp.availability import next_free_window # rental date checks
+from flaskapp.stats import item_stats # popularity figures for pricing
+from flaskapp.favourites import favourite_ids, favourite_items_query, change_favourites # favourites as sets of item ids
+from flaskapp.bookings import book_rental, ItemUnavailable, InsufficientCredits # transactional rentals
+from flaskapp.jobs import enqueue, notify # background image processing
+from flaskapp.storage import store_upload # content addressed image files
+from flaskapp.pagecache import page_cache, page_etag, not_modified, with_etag # rendered item lists and 304s
+from flaskapp.passwords import hash_password, check_password, HashingBusy # bcrypt off the request threads
 from flask_login import login_user, current_user, logout_user # session handling
+from markupsafe import Markup # cached html is inserted into pages as is
+from flask_wtf.csrf import validate_csrf # CSRF check for JSON requests
+from wtforms.validators import ValidationError
 
 # ------------- ROUTES ------------- #
 
+# All pages are registered on the app in create_app
+main = Blueprint('main', __name__)
+
 # Routes are what are typed into browser to access the web application
-@app.route("/")
+@main.route("/")
 # Home page can be accessed now from either route
-@app.route("/home")
+@main.route("/home")
 def homePage():
-    # Retrieve all items from the database
-    items = Items.query.all()
-    
-    # Render the homepage template and pass items to it
-    return render_template('home.html', items=items)
+    # Keyset pagination: each page continues from the last item id seen, so a
+    # page costs the same however large the catalogue gets
+    per_page = current_app.config['ITEMS_PER_PAGE']
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    # Nothing has changed since this visitor last loaded the page
+    etag = page_etag(current_user)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    # The item list is rendered once per catalogue version and page (and user, for the hearts)
+    feed = page_cache.fragment(('home', after, before, current_user.get_id()), lambda: render_feed(per_page, after, before))
+    return with_etag(make_response(render_template('home.html', feed=Markup(feed))), etag)
+
+def feed_query(per_page, after, before):
+    # One page of the feed plus one row to tell whether there is another.
+    # Only load the columns the feed template displays
+    items = db.session.query(Items.id, Users.username, Items.image_file, Items.image_status, Items.brand, Items.colour, Items.typeOfClothing, Items.size).outerjoin(Users, Users.id == Items.userID)
+    if before is not None:
+        # Walk backwards from the first item of the current page
+        return items.filter(Items.id < before).order_by(Items.id.desc()).limit(per_page + 1)
+    if after is not None:
+        items = items.filter(Items.id > after)
+    return items.order_by(Items.id).limit(per_page + 1)
+
+def render_feed(per_page, after, before):
+    items = feed_query(per_page, after, before).all()
+    if before is not None:
+        has_more = len(items) > per_page
+        items = items[:per_page][::-1]
+        prev_id = items[0].id if items and has_more else None
+        next_id = items[-1].id if items else None
+    else:
+        has_more = len(items) > per_page
+        items = items[:per_page]
+        prev_id = items[0].id if items and after is not None else None
+        next_id = items[-1].id if items and has_more else None
+
+    # Render the item list and pagination links, with the user's favourites loaded in one query
+    favourited = favourite_ids(current_user.id) if current_user.is_authenticated else set()
+    return render_template('home_feed.html', items=items, prev_id=prev_id, next_id=next_id, favourited=favourited)
 
 # This function returns what will be shown on the web application for the specific route "/" 
 # Windows command set FLASK_APP=flaskapp.py sets environment variable :D
 # Use python -m flask run to run
 
 # Makes search form available in all templates
-@app.context_processor
+@main.app_context_processor
 def layout():
     form = SearchForm()
     return dict(form=form)
 
 # Route for the search functionality
-@app.route("/search", methods=['POST'])
+@main.route("/search", methods=['POST'])
 def search():
     form = SearchForm()
-    items = Items.query
-    # Lists to hold matching item IDs by attribute 
-    colour_list=[]
-    brand_list=[]
-    typeOfClothing_list=[]
 
     # Validate and process search input
     if form.validate_on_submit():
-        item_searched = form.searched.data
-        item_words = item_searched.split()
-
-        # Search by each word entered 
-        for i in range(0, len(item_words)):
-            word = item_words[i]
-            word = word.replace('-', '')
-            search = word[0].upper()+word[1:].lower()
-
-            # Query database by colour, brand and clothing type
-            items_colour = Items.query.filter_by(colour=search).all()
-            for j in items_colour:
-                colour_list.append(j.id)
-            items_brand = Items.query.filter_by(brand=search).all()
-            for k in items_brand:
-                brand_list.append(k.id)
-            items_typeOfClothing = Items.query.filter_by(typeOfClothing=search).all()
-            for l in items_typeOfClothing:
-                typeOfClothing_list.append(l.id)
-        
-        # Combine results from all categories
-        all_items = colour_list + brand_list + typeOfClothing_list
-
-        # Remove duplicates and identify multi-matched items
-        newlist=[]
-        duplist=[]
-        triplist=[]
-        for i in all_items:
-            if i not in newlist:
-                newlist.append(i)
-            elif i not in duplist:
-                duplist.append(i)
-            else:
-                triplist.append(i)
-        
-        # Prioritize items matched by more than one attribute
-        if len(triplist)>0:
-            all_items=triplist
-        elif len(duplist)>0:
-            all_items=duplist
-        
-        # Build final SQL query and return matched items
-        final_items=Items.query.filter(False)
-        for i in all_items:
-            specific_item = items.filter(Items.id.like(i))
-            final_items = final_items.union(specific_item)
-        
-        return render_template('search.html', form=form, items=items, final_items=final_items)
+        # Items matching the most attributes (colour, brand, clothing type) come first.
+        # Searches for the same words share one rendered result list
+        words = tuple(sorted({normalise(word) for word in form.searched.data.split()} - {''}))
+        results = page_cache.fragment(('search', words, current_user.get_id()), lambda: render_template('search_results.html',
+            final_items=search_index.search(form.searched.data, current_app.config['SEARCH_RESULTS']),
+            favourited=favourite_ids(current_user.id) if current_user.is_authenticated else set()))
+
+        return render_template('search.html', form=form, results=Markup(results))
     
     # Redirect to home if invalid form
-    return redirect(url_for('homePage'))
+    return redirect(url_for('main.homePage'))
+
+# Filtered catalogue for narrowing down by type, colour, size, brand and credits
+@main.route("/items")
+def items():
+    selected, min_credits, max_credits = parse_filters(request.args)
+    matches, counts = facet_index.filter(selected, min_credits, max_credits)
+
+    # Keyset pagination over the matching ids, like the home feed
+    per_page = current_app.config['ITEMS_PER_PAGE']
+    after = max(request.args.get('after', 0, type=int), 0)
+    page_ids = ids_of(matches, after, per_page + 1)
+    next_id = page_ids[per_page - 1] if len(page_ids) > per_page else None
+    page_ids = page_ids[:per_page]
+
+    rows = item_rows_query(page_ids).all() if page_ids else []
+
+    return jsonify(
+        total=matches.bit_count(),
+        items=[row._asdict() for row in rows],
+        facets=counts,
+        next=url_for('main.items', **{**request.args.to_dict(flat=False), 'after': next_id}) if next_id else None,
+    )
+
+
+def item_rows_query(item_ids):
+    return db.session.query(Items.id, Users.username, Items.image_file, Items.image_status, Items.brand, Items.colour, Items.typeOfClothing, Items.size, Items.minimumCredits).outerjoin(Users, Users.id == Items.userID).filter(Items.id.in_(item_ids)).order_by(Items.id)
 
 
 # ------------- SIGNUP ------------- #
 
-@app.route("/signup", methods=['GET', 'POST'])
+@main.route("/signup", methods=['GET', 'POST'])
 def signup():
     # Redirect logged in users away from signup 
     if current_user.is_authenticated:
-        return redirect(url_for('homePage'))
+        return redirect(url_for('main.homePage'))
     form = SignupForm()
 
     # If form was validated on submitting it
     if form.validate_on_submit(): 
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8') # Makes it a string
+        try:
+            hashed_password = hash_password(form.password.data)
+        except HashingBusy:
+            flash('The site is busy right now, please try again in a moment', 'danger')
+            return render_template('signup.html', title='SignUp', form=form)
 
         # Create a new user record
         user = Users(username=form.username.data, password=hashed_password)
@@ -117,17 +152,17 @@ def signup():
         # Flash success message and redirect to login
         flash('Your account has been created you are now able to login!', 'success') 
         # Flash message sends a one time alert
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     return render_template('signup.html', title='SignUp', form=form)
 
 
 # ------------- LOGIN ------------- #
-@app.route("/login", methods=['GET', 'POST'])
+@main.route("/login", methods=['GET', 'POST'])
 def login():
     # Prevent logged in users from loggin in again
     if current_user.is_authenticated:
-        return redirect(url_for('homePage'))
+        return redirect(url_for('main.homePage'))
     
     form = LoginForm()
 
@@ -136,31 +171,29 @@ def login():
         user = Users.query.filter_by(username=form.username.data).first()
 
         # Check password hash
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
-            login_user(user)
-            return redirect(url_for('homePage'))
-        else:
-            flash('Login Unsuccesful, please check username and password', 'danger')
+        try:
+            if user and check_password(user, form.password.data):
+                login_user(user)
+                return redirect(url_for('main.homePage'))
+            else:
+                flash('Login Unsuccesful, please check username and password', 'danger')
+        except HashingBusy:
+            flash('The site is busy right now, please try again in a moment', 'danger')
 
     return render_template('login.html', title='Login', form=form)
 
 
 # ------------- IMAGE ------------- #
 def save_picture(form_image):
-    # Generate a random filename to avoid name collisions
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_image.filename)
-    image_fn = random_hex + f_ext
-    image_path = os.path.join(app.root_path, 'static/image_pics', image_fn)
-
-    # Save uploaded image to the static folder
-    form_image.save(image_path)
+    # Name the file after a hash of its contents so identical photos are only stored once
+    image_fn = store_upload(form_image)
 
+    # Resizing happens in a background job
     return image_fn
 
 
 # ------------- ITEM UPLOAD ------------- #
-@app.route("/upload", methods=['GET', 'POST'])
+@main.route("/upload", methods=['GET', 'POST'])
 def upload():
     if current_user.is_authenticated:
         form = UploadForm()
@@ -173,165 +206,159 @@ def upload():
             # Save uploaded image and create new item record
             if form.image.data:
                 picture_file = save_picture(form.image.data)
-                item = Items(userID=current_user.username, typeOfClothing=form.typeOfClothing.data, image_file=picture_file, brand=corrected_brand, colour=form.colour.data, size=form.size.data, minimumCredits=form.minimumCredits.data)
+                item = Items(userID=current_user.id, typeOfClothing=form.typeOfClothing.data, image_file=picture_file, brand=corrected_brand, colour=form.colour.data, size=form.size.data, minimumCredits=form.minimumCredits.data)
             
             db.session.add(item)
+            db.session.flush() # gives the item its id for the image job
+            enqueue(item)
             db.session.commit()
+            notify()
+            search_index.add_item(item)
+            facet_index.add_item(item)
+            page_cache.invalidate()
             flash('Your item has now been posted!', 'success')
-            return redirect(url_for('homePage'))
+            return redirect(url_for('main.homePage'))
         
         return render_template('upload.html', title='Upload', form=form)
     
     else:
-      return redirect(url_for('homePage'))
+      return redirect(url_for('main.homePage'))
 
 
 # ------------- RENTING ------------- #
-@app.route("/rent/<int:item_id>", methods=['GET', 'POST'])
+@main.route("/rent/<int:item_id>", methods=['GET', 'POST'])
 def rent(item_id):
-    itemFree = True
-    recentRentals = []
     daysRented = 0
     additionalCredits = 0
     numOfFavs = 0
 
     item = Items.query.get_or_404(item_id)
     minCredits = item.minimumCredits
-    poster = item.userID
-    now = datetime.today().date()
-    oldDate = now + relativedelta(months=-6) # Calculate date 6 months ago
 
     if current_user.is_authenticated:
         form = ItemRental()
 
         if form.validate_on_submit():
-            # Retrieve all past rentals for this item
-            allRentals = Rentals.query.filter_by(itemID=item_id).all()
-
-            # Filter rentals in the last 6 months
-            for i in allRentals:
-                if i.startDate>=oldDate:
-                    recentRentals.append(i)
-            
-            # How many rental days in last 6 months
-            for i in recentRentals:
-                numOfDays = i.endDate - i.startDate
-                daysRented = daysRented + numOfDays.days
-
-            # Count how many users have favourited this item
-            favourites = Favourites.query.filter_by(itemID=item_id)
-            for i in favourites:
-                numOfFavs = numOfFavs + 1
+            # Popularity over the last 6 months, kept up to date as rentals and favourites are written
+            stats = item_stats(item_id)
+            daysRented = stats.daysRented
+            numOfFavs = stats.favourites
 
             # Validate rental date range
             if form.endDate.data <= form.startDate.data:
                 flash('Please choose an end date that falls after the chosen start date', 'failure')
             else:
-                # Check if item is available in chosen dates
-                rentals = Rentals.query.filter_by(itemID=item_id).all()
-                for i in rentals:
-                    if i.startDate <= form.startDate.data and i.endDate >= form.startDate.data:
-                        flash('Item is unavailable on the chosen dates', 'failure')
-                        itemFree = False
-                        break
-                    elif i.startDate <= form.endDate.data and i.endDate >= form.endDate.data:
-                        flash('Item is unavailable on the chosen dates', 'failure')
-                        itemFree = False
-                        break
-                    elif i.startDate >= form.startDate.data and i.endDate <= form.endDate.data:
-                        flash('Item is unavailable on the chosen dates', 'failure')
-                        itemFree = False
-                        break
+                # Calculate bonus credits based on item popularity and history
+                if daysRented >=150:
+                    additionalCredits = additionalCredits + 30
+                elif daysRented >=100:
+                    additionalCredits = additionalCredits + 20
+                elif daysRented >=50:
+                    additionalCredits = additionalCredits + 10
+                elif daysRented >=25:
+                    additionalCredits = additionalCredits + 5
                 
-                if itemFree == True:
-                    # Calculate bonus credits based on item popularity and history
-                    if daysRented >=150:
-                        additionalCredits = additionalCredits + 30
-                    elif daysRented >=100:
-                        additionalCredits = additionalCredits + 20
-                    elif daysRented >=50:
-                        additionalCredits = additionalCredits + 10
-                    elif daysRented >=25:
-                        additionalCredits = additionalCredits + 5
-                    
-                    # Add credits based on number of favourites
-                    favCredits = round(numOfFavs/10)
-                    additionalCredits = additionalCredits + favCredits
-
-                    # Add credits based on rental duration
-                    days = form.endDate.data - form.startDate.data
-                    credsPerDay = days.days * 5
-                    additionalCredits = additionalCredits + credsPerDay
-
-                    # Final credit cost
-                    calcCredits = minCredits + additionalCredits
-                    
-                    # Check if user can afford it
-                    if current_user.credit_balance >= calcCredits:
-                        new_balance = current_user.credit_balance - calcCredits
-
-                        # Transfer credits to item owner
-                        current_user.credit_balance = new_balance
-                        user = Users.query.filter_by(username=poster).first()
-                        postersBalance = user.credit_balance
-                        postersBalance = postersBalance + calcCredits
-                        user.credit_balance = postersBalance
-
-                        # Record the rental
-                        rental = Rentals(userID=current_user.username, itemID=item_id, startDate=form.startDate.data, endDate=form.endDate.data, credit=calcCredits)
-
-                        db.session.add(rental)
-                        db.session.commit()
-
-                        flash('Rental successful!', 'success')
-                        return redirect(url_for('homePage'))
-                    else:
-                        flash('Not enough credits', 'failure')
+                # Add credits based on number of favourites
+                favCredits = round(numOfFavs/10)
+                additionalCredits = additionalCredits + favCredits
+
+                # Add credits based on rental duration
+                days = form.endDate.data - form.startDate.data
+                credsPerDay = days.days * 5
+                additionalCredits = additionalCredits + credsPerDay
+
+                # Final credit cost
+                calcCredits = minCredits + additionalCredits
+
+                # Check availability, transfer credits to item owner and record the rental in one transaction
+                try:
+                    book_rental(item, current_user, form.startDate.data, form.endDate.data, calcCredits)
+                except ItemUnavailable:
+                    freeStart, freeEnd = next_free_window(item_id, form.startDate.data, form.endDate.data)
+                    flash(f'Item is unavailable on the chosen dates, the next free dates are {freeStart} to {freeEnd}', 'failure')
+                except InsufficientCredits:
+                    flash('Not enough credits', 'failure')
+                else:
+                    page_cache.invalidate()
+                    flash('Rental successful!', 'success')
+                    return redirect(url_for('main.homePage'))
 
         return render_template('rent.html', title='Rental', form=form, item=item)
     
     else:
-      return redirect(url_for('homePage'))  
+      return redirect(url_for('main.homePage'))  
 
 
 # ------------- FAVOURITES ------------- #
-@app.route("/favourite/<int:item_id>", methods=['GET', 'POST'])
+@main.route("/favourite/<int:item_id>", methods=['GET', 'POST'])
 def favourite(item_id):
     if current_user.is_authenticated:
-        # Avoid duplicate favourites
-        duplicate = Favourites.query.filter_by(userID=current_user.id, itemID=item_id).first()
-        if duplicate:
-            return redirect(url_for('homePage'))
-        
-        else:
-            favourite = Favourites(userID=current_user.id, itemID=item_id)
-            db.session.add(favourite)
-            db.session.commit()
-            return redirect(url_for('homePage'))
+        # Items already favourited are left alone
+        added, _, _ = change_favourites(current_user.id, add=[item_id])
+        if added:
+            page_cache.invalidate()
         
-    return redirect(url_for('homePage'))
+    return redirect(url_for('main.homePage'))
 
-@app.route("/unfavourite/<int:item_id>", methods=['GET', 'POST'])
+@main.route("/unfavourite/<int:item_id>", methods=['GET', 'POST'])
 def unfavourite(item_id):
     # Remove favourite record
-    unfavourite = Favourites.query.filter_by(userID=current_user.id, itemID=item_id).delete()
-    db.session.commit()
-    return redirect(url_for('favourites'))
-
-@app.route("/favourites", methods=['GET', 'POST'])
+    if current_user.is_authenticated:
+        _, removed, _ = change_favourites(current_user.id, remove=[item_id])
+        if removed:
+            page_cache.invalidate()
+    return redirect(url_for('main.favourites'))
+
+# Add and remove many favourites at once, e.g. {"add": [1, 2], "remove": [3]}
+@main.route("/favourites/bulk", methods=['POST'])
+def bulk_favourites():
+    if not current_user.is_authenticated:
+        return jsonify(error='Please log in first'), 401
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            return jsonify(error='Missing or invalid CSRF token'), 400
+
+    # Expects {"add": [ids], "remove": [ids]}, either list may be left out
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error='Expected a JSON object with add and remove lists'), 400
+    lists = [data.get('add', []), data.get('remove', [])]
+    if not all(isinstance(ids, list) and all(type(item_id) in (int, str) for item_id in ids) for ids in lists):
+        return jsonify(error='add and remove must be lists of item ids'), 400
+    try:
+        add, remove = ([int(item_id) for item_id in ids] for ids in lists)
+    except ValueError:
+        return jsonify(error='add and remove must be lists of item ids'), 400
+
+    added, removed, favourites = change_favourites(current_user.id, add, remove)
+    if added or removed:
+        page_cache.invalidate()
+    return jsonify(added=sorted(added), removed=sorted(removed), favourites=sorted(favourites))
+
+@main.route("/favourites", methods=['GET', 'POST'])
 def favourites():
     if current_user.is_authenticated:
-        # Join favourites table with items to get item info 
-        favs = db.session.query(Favourites, Items).filter(Favourites.userID==current_user.id).join(Items, Items.id==Favourites.itemID).all()
-
-        return render_template('favourites.html', favs=favs)
+        etag = page_etag(current_user)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+
+        def render_favourites():
+            # Join favourites table with items to get item info 
+            favs = favourite_items_query(current_user.id).all()
+            return render_template('favourites_list.html', favs=favs)
+
+        favs = page_cache.fragment(('favourites', current_user.id), render_favourites)
+        return with_etag(make_response(render_template('favourites.html', favs=Markup(favs))), etag)
     
-    return redirect(url_for('homePage'))
+    return redirect(url_for('main.homePage'))
 
 
 # ------------- LOGOUT ------------- #
-@app.route("/logout")
+@main.route("/logout")
 def logout():
     logout_user()
-    return redirect(url_for('homePage'))
+    return redirect(url_for('main.homePage'))
 
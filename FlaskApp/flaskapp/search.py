@@ -0,0 +1,128 @@
+import heapq
+import threading
+from flask import current_app
+from werkzeug.local import LocalProxy
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy.orm import joinedload
+from flaskapp import db
+from flaskapp.models import Items
+
+# ------------- SEARCH INDEX ------------- #
+
+# Item attributes that the search bar matches words against
+SEARCH_FIELDS = ('colour', 'brand', 'typeOfClothing')
+
+
+# Search words are matched the same way brands are stored on upload, e.g. "bLaCk" -> "Black"
+def normalise(word):
+    word = word.replace('-', '')
+    if not word:
+        return ''
+    return word[0].upper()+word[1:].lower()
+
+
+def add_posting(ids, item_id):
+    # Adds item_id to a sorted array of ids, returns False if it was already there.
+    # Ids nearly always arrive in ascending order so this is normally an append
+    if not ids or ids[-1] < item_id:
+        ids.append(item_id)
+        return True
+    pos = bisect_left(ids, item_id)
+    if pos < len(ids) and ids[pos] == item_id:
+        return False
+    ids.insert(pos, item_id)
+    return True
+
+
+class IncrementalIndex:
+    # In memory index over some Items columns, shared by the search and facet indexes.
+    # Subclasses list the columns in COLUMNS and fill in _reset and _index
+
+    COLUMNS = ()
+
+    def __init__(self):
+        self._reset()
+        self.lock = threading.Lock()
+
+    def _reset(self):
+        # Highest item id indexed so far, newer rows are picked up incrementally
+        self.last_id = 0
+
+    def _index(self, item_id, values):
+        raise NotImplementedError
+
+    def _add(self, item_id, values):
+        self._index(item_id, values)
+        if item_id > self.last_id:
+            self.last_id = item_id
+
+    def add_item(self, item):
+        # Keep the index in sync when an item is uploaded in this process
+        with self.lock:
+            self._add(item.id, [getattr(item, column) for column in self.COLUMNS])
+
+    def new_rows_query(self):
+        # Only rows we have not seen yet, so items uploaded through other workers
+        # show up without rebuilding the whole index
+        columns = [Items.id] + [getattr(Items, column) for column in self.COLUMNS]
+        return db.session.query(*columns).filter(Items.id > self.last_id).order_by(Items.id)
+
+    def refresh(self):
+        with self.lock:
+            rows = self.new_rows_query().all()
+            for row in rows:
+                self._add(row[0], row[1:])
+
+    def clear(self):
+        with self.lock:
+            self._reset()
+
+
+class SearchIndex(IncrementalIndex):
+
+    COLUMNS = SEARCH_FIELDS
+
+    def _reset(self):
+        super()._reset()
+        # field -> attribute value -> sorted array of item ids
+        self.postings = {field: {} for field in SEARCH_FIELDS}
+
+    def _index(self, item_id, values):
+        for field, value in zip(SEARCH_FIELDS, values):
+            if value:
+                add_posting(self.postings[field].setdefault(value, array('l')), item_id)
+
+    def rank(self, query, limit=None):
+        # Returns item ids ordered by how many attributes matched the query words, the best limit of them
+        self.refresh()
+        words = {normalise(word) for word in query.split()}
+        words.discard('')
+
+        scores = Counter()
+        with self.lock:
+            for word in words:
+                for field in SEARCH_FIELDS:
+                    scores.update(self.postings[field].get(word, ()))
+
+        order = lambda s: (-s[1], s[0])
+        best = sorted(scores.items(), key=order) if limit is None else heapq.nsmallest(limit, scores.items(), key=order)
+        return [item_id for item_id, _ in best]
+
+    def search(self, query, limit=None):
+        # Fetch the best matching items in a single WHERE id IN (...) query
+        ranked = self.rank(query, limit)
+        if not ranked:
+            return []
+        found = {item.id: item for item in items_query(ranked).all()}
+        return [found[item_id] for item_id in ranked if item_id in found]
+
+
+def items_query(item_ids):
+    # Items with their owners, for showing search results
+    return Items.query.filter(Items.id.in_(item_ids)).options(joinedload(Items.owner))
+
+
+# Each app (and so each worker process) has its own index, see create_app
+search_index = LocalProxy(lambda: current_app.extensions['search_index'])
@@ -0,0 +1,98 @@
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+from sqlalchemy import func
+from flaskapp import db
+from flaskapp.models import Rentals, Favourites, ItemStats
+
+# ------------- ITEM STATS ------------- #
+
+# Popularity figures used for dynamic pricing in rent(). They are updated as rentals and
+# favourites are written, so pricing is a primary key lookup instead of a scan of history.
+
+def window_start():
+    # Rentals starting in the last 6 months count towards popularity
+    from dateutil.relativedelta import relativedelta # imported on first use to keep worker boot lean
+    return datetime.today().date() + relativedelta(months=-6)
+
+def rentals_query(item_id, oldDate):
+    return db.session.query(Rentals.startDate, Rentals.endDate).filter(Rentals.itemID == item_id, Rentals.startDate >= oldDate)
+
+def favourite_count_query(item_id):
+    return db.session.query(func.count(Favourites.id)).filter(Favourites.itemID == item_id)
+
+def recompute_item(item_id, oldDate=None):
+    oldDate = oldDate or window_start()
+    daysRented = sum((end - start).days for start, end in rentals_query(item_id, oldDate))
+    numOfFavs = favourite_count_query(item_id).scalar()
+
+    db.session.execute(stats_upsert(db.engine.dialect.name, item_id, daysRented, numOfFavs, oldDate))
+    return db.session.get(ItemStats, item_id, populate_existing=True)
+
+def stats_upsert(dialect, item_id, daysRented, numOfFavs, oldDate):
+    # Two requests can price an item for the first time at once, so the row is written with an
+    # upsert instead of an INSERT that would fail on the primary key. A row another request
+    # already brought up to this window is kept, it may hold increments this count missed
+    row = {'itemID': item_id, 'daysRented': daysRented, 'favourites': numOfFavs, 'windowStart': oldDate}
+    changed = [('daysRented', daysRented), ('favourites', numOfFavs), ('windowStart', oldDate)]
+    stale = ItemStats.windowStart != oldDate
+    if dialect in ('mysql', 'mariadb'):
+        # No WHERE on ON DUPLICATE KEY UPDATE, each column keeps its value unless the row is stale.
+        # Assignments run in order, so windowStart is changed last
+        from sqlalchemy.dialects.mysql import insert
+        return insert(ItemStats).values(row).on_duplicate_key_update(
+            [(column, func.if_(stale, value, getattr(ItemStats, column))) for column, value in changed])
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(ItemStats).values(row).on_conflict_do_update(index_elements=[ItemStats.itemID], where=stale, set_=dict(changed))
+
+def item_stats(item_id):
+    # Rows are refreshed once the 6 month window has moved on, which drops rentals that aged out
+    stats = ItemStats.query.get(item_id)
+    oldDate = window_start()
+    if stats is None or stats.windowStart != oldDate:
+        stats = recompute_item(item_id, oldDate)
+    return stats
+
+def record_rental(item_id, startDate, endDate):
+    # Atomic increment so concurrent rentals of the same item are not lost
+    ItemStats.query.filter(ItemStats.itemID == item_id, ItemStats.windowStart <= startDate).update(
+        {ItemStats.daysRented: ItemStats.daysRented + (endDate - startDate).days}, synchronize_session=False)
+
+def record_favourites(item_ids, count):
+    # Adds count to each item's favourites, count is negative when favourites are removed.
+    # item_ids is one id or a list, so a batch is a single UPDATE
+    if isinstance(item_ids, int):
+        item_ids = [item_ids]
+    ItemStats.query.filter(ItemStats.itemID.in_(item_ids)).update(
+        {ItemStats.favourites: ItemStats.favourites + count}, synchronize_session=False)
+
+def recompute_all():
+    # Rebuilds every row from Rentals and Favourites, repairing any drift
+    oldDate = window_start()
+    daysRented = {}
+    for item_id, start, end in db.session.query(Rentals.itemID, Rentals.startDate, Rentals.endDate).filter(Rentals.startDate >= oldDate).yield_per(1000):
+        daysRented[item_id] = daysRented.get(item_id, 0) + (end - start).days
+    favourites = dict(db.session.query(Favourites.itemID, func.count(Favourites.id)).group_by(Favourites.itemID).all())
+
+    ItemStats.query.delete()
+    db.session.bulk_insert_mappings(ItemStats, [
+        {'itemID': item_id, 'daysRented': daysRented.get(item_id, 0), 'favourites': favourites.get(item_id, 0), 'windowStart': oldDate}
+        for item_id in set(daysRented) | set(favourites)])
+    db.session.commit()
+    return len(set(daysRented) | set(favourites))
+
+
+# ------------- CLI ------------- #
+
+@click.group(cls=AppGroup)
+def stats():
+    """Item popularity statistics."""
+
+@stats.command('recompute')
+def recompute_command():
+    """Rebuild the ItemStats table from rentals and favourites."""
+    count = recompute_all()
+    click.echo(f'Recomputed stats for {count} items')
@@ -0,0 +1,84 @@
+import click
+import hashlib
+import os
+import re
+import tempfile
+from flask import current_app, request
+from flaskapp.models import Items
+from flaskapp.images import image_dir, variant_name, VARIANTS, images
+
+# ------------- IMAGE STORE ------------- #
+
+# Uploaded images are named after a hash of their bytes, so the same photo uploaded twice
+# is stored once and a URL always points at the same content. An image is referenced by
+# every item whose image_file names it, flask images gc deletes it once nothing does.
+
+CHUNK_SIZE = 64 * 1024
+# Hex digits of the sha256 used in file names, 128 bits is plenty to avoid collisions
+HASH_LENGTH = 32
+# Originals stored under their hash and their variants, whose names add the size and quality
+# they were made with. Older uploads have random names, so only these can be cached as immutable
+HASHED_NAME = re.compile(r'image_pics/(?:(?:%s)/[0-9a-f]{%d}-\d+x\d+-q\d+|[0-9a-f]{%d})\.\w+' % ('|'.join(VARIANTS), HASH_LENGTH, HASH_LENGTH))
+
+
+def store_upload(file_storage):
+    # Streams the upload to a temporary file while hashing it, then moves it into place
+    _, f_ext = os.path.splitext(file_storage.filename)
+    f_ext = f_ext.lower().replace('.jpeg', '.jpg')
+    digest = hashlib.sha256()
+
+    with tempfile.NamedTemporaryFile(dir=image_dir(), suffix='.part', delete=False) as temp:
+        while True:
+            chunk = file_storage.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            temp.write(chunk)
+
+    image_fn = digest.hexdigest()[:HASH_LENGTH] + f_ext
+    image_path = os.path.join(image_dir(), image_fn)
+    if os.path.exists(image_path):
+        # Already stored by an earlier upload
+        os.remove(temp.name)
+    else:
+        os.replace(temp.name, image_path)
+    return image_fn
+
+
+def cache_images(response):
+    # after_request hook registered in create_app. Long lived, immutable caching for stored
+    # originals and their variants, everything else keeps the ETag revalidation Flask's static handler gives it
+    if request.endpoint == 'static' and HASHED_NAME.fullmatch(request.view_args.get('filename', '')) and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['IMAGE_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+# ------------- CLI ------------- #
+
+@images.command('gc')
+@click.option('--dry-run', is_flag=True, help='Only list the files that would be deleted.')
+def gc_command(dry_run):
+    """Delete stored images that no item refers to."""
+    referenced = {image_fn for (image_fn,) in Items.query.with_entities(Items.image_file).distinct()}
+    keep = set(referenced)
+    for image_fn in referenced:
+        keep.update(variant_name(image_fn, variant) for variant in VARIANTS)
+
+    removed = 0
+    for folder in ('',) + VARIANTS:
+        path = os.path.join(image_dir(), folder)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            relative = folder + '/' + name if folder else name
+            # .part files are uploads still being written
+            if os.path.isdir(os.path.join(path, name)) or relative in keep or name.endswith('.part'):
+                continue
+            click.echo(relative)
+            if not dry_run:
+                os.remove(os.path.join(path, name))
+            removed += 1
+    click.echo(f"{'Would remove' if dry_run else 'Removed'} {removed} files")
@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# ------------- STARTUP ------------- #
+
+# create_app records how long each step of building the app takes, and warm() does the
+# work a worker would otherwise do on its first requests. A server that loads the app once
+# and then forks its workers (wsgi.py, or gunicorn --preload) pays for both in the parent
+# only, every worker starts from a copy of the warmed process.
+
+
+class StartupTimer:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        # (step, seconds) in the order they ran
+        self.steps = []
+
+    def mark(self, step):
+        # Records the time since the previous mark against step
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self):
+        return {'steps': {step: round(seconds, 4) for step, seconds in self.steps}, 'total': round(self.last - self.started, 4)}
+
+
+def warm(app):
+    # Call once in the process that will fork the workers
+    from sqlalchemy import text
+    from sqlalchemy.orm import configure_mappers
+    from flaskapp import db
+    from flaskapp.images import webp_supported
+    from flaskapp.migrations import check_current
+    timer = app.extensions['startup']
+    timer.mark('before warm')
+
+    # Fail here, before any worker starts, rather than with a 500 on every page
+    with app.app_context():
+        check_current()
+        timer.mark('schema')
+
+    # Compile every template now instead of on the first request for each page
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    timer.mark('templates')
+
+    with app.app_context():
+        # Build the mapper relationships and let the dialect read the server version
+        configure_mappers()
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        timer.mark('engine')
+
+        # Load the search and facet indexes so the first search does not read the whole catalogue
+        app.extensions['search_index'].refresh()
+        app.extensions['facet_index'].refresh()
+        db.session.remove()
+        timer.mark('indexes')
+
+        # Loads Pillow's feature table, thumbnails in every page need it
+        webp_supported()
+        timer.mark('image support')
+
+        # Connections must not be shared between processes. The pool is emptied before forking,
+        # and a child that inherits one anyway drops it without closing the parent's socket.
+        # Windows has no fork, workers there are new processes that build their own app
+        db.engine.dispose()
+        engine = db.engine
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+    timer.mark('fork safety')
+    return app
+
+
+# ------------- CLI ------------- #
+
+@click.command('startup-report')
+@click.option('--warm/--no-warm', 'warm_app', default=True, help='Include warming the app.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+@click.option('--budget', type=float, help='Fail if the whole startup takes longer than this many seconds.')
+@with_appcontext
+def startup_report_command(warm_app, as_json, budget):
+    """Time a fresh app boot, step by step."""
+    # Modules already imported by this process are not counted, so time a fresh interpreter
+    import subprocess
+    script = ('import json, time; started = time.perf_counter(); '
+              'from flaskapp import create_app; imported = time.perf_counter() - started; '
+              'app = create_app(); '
+              + ('from flaskapp.warmup import warm; warm(app); ' if warm_app else '') +
+              'report = app.extensions["startup"].report(); report["import"] = round(imported, 4); '
+              'report["boot"] = round(time.perf_counter() - started, 4); '
+              'report["modules"] = len(__import__("sys").modules); print(json.dumps(report))')
+    root = os.path.dirname(current_app.root_path)
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))))
+    if output.returncode:
+        raise click.ClickException(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'startup failed')
+    report = json.loads(output.stdout.strip().splitlines()[-1])
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(f"{'import flaskapp':<20}{report['import']:>9.4f}s")
+        for step, seconds in report['steps'].items():
+            click.echo(f'{step:<20}{seconds:>9.4f}s')
+        click.echo(f"{'total boot':<20}{report['boot']:>9.4f}s  ({report['modules']} modules loaded)")
+    if budget is not None and report['boot'] > budget:
+        raise click.ClickException(f"Startup took {report['boot']:.3f}s, over the {budget:.3f}s budget")
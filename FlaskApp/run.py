@@ -1,10 +1,11 @@
-#from flaskapp import create_app
-from flaskapp import app
-from flask import Flask
+from flaskapp import create_app
+from flaskapp.migrations import upgrade
 
-#app = create_app()
-#app.app_context().push()
+app = create_app()
 
-#with app.app_context():
+# Development server, wsgi.py is the production entry point with pre-forked workers
 if __name__ == '__main__': # Changes will be made to the web app without stopping and starting it when running it through a terminal using python run.py
+    # Bring the development database up to date, in production run 'flask db upgrade' when deploying
+    with app.app_context():
+        upgrade()
     app.run(debug=True)
@@ -0,0 +1,74 @@
+import os
+import sys
+import pytest
+
+# Run from anywhere, the app is imported from the folder above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp import create_app, db, bcrypt
+from flaskapp.config import TestConfig
+from flaskapp.migrations import upgrade
+from flaskapp.models import Users, Items
+
+PASSWORD = 'secret1'
+
+
+def make_app(config=TestConfig):
+    app = create_app(config)
+    with app.app_context():
+        upgrade()
+    return app
+
+def file_config(path):
+    # TestConfig on a database file, for tests that need several connections at once
+    return type('FileConfig', (TestConfig,), {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(path)})
+
+def add_user(username, credit_balance=100):
+    user = Users(username=username, password=bcrypt.generate_password_hash(PASSWORD, 4).decode('utf-8'), credit_balance=credit_balance)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def add_item(owner, **fields):
+    values = dict(typeOfClothing='Dress', colour='Black', size='M', brand='Zara', minimumCredits=10)
+    values.update(fields)
+    item = Items(userID=owner.id, **values)
+    db.session.add(item)
+    db.session.commit()
+    return item
+
+def log_in(client, username):
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def app():
+    app = make_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def image_store(app):
+    # Files written to static/image_pics by a test are deleted afterwards
+    from flaskapp.images import image_dir
+    def listing():
+        return {os.path.join(folder, name) for folder, _, names in os.walk(image_dir()) for name in names}
+    before = listing()
+    yield image_dir()
+    for path in listing() - before:
+        os.remove(path)
+
+@pytest.fixture
+def owner(app):
+    return add_user('poster01')
+
+@pytest.fixture
+def renter(app):
+    return add_user('renter01')
+
+@pytest.fixture
+def client(app, renter):
+    return log_in(app.test_client(), renter.username)
@@ -0,0 +1,60 @@
+import pytest
+from datetime import date, timedelta
+from flaskapp import db
+from flaskapp.availability import is_available, next_free_window
+from flaskapp.models import Rentals
+from conftest import add_item
+
+START = date.today() + timedelta(days=30)
+
+
+def day(n):
+    return START + timedelta(days=n)
+
+def book(item, renter, start, end):
+    db.session.add(Rentals(userID=renter.id, itemID=item.id, startDate=day(start), endDate=day(end), credit=10))
+    db.session.commit()
+
+
+def test_booked_dates_are_unavailable(app, owner, renter):
+    item = add_item(owner)
+    book(item, renter, 10, 12)
+    assert not is_available(item.id, day(11), day(11))
+    # Both ends of a rental are taken
+    assert not is_available(item.id, day(12), day(14))
+    assert not is_available(item.id, day(8), day(10))
+    assert is_available(item.id, day(13), day(15))
+    assert is_available(add_item(owner).id, day(10), day(12))
+
+
+@pytest.mark.parametrize('bookings, wanted, window', [
+    # Nothing booked
+    ([], (3, 5), (3, 5)),
+    # Moved past the rental it collides with
+    ([(10, 12)], (11, 13), (13, 15)),
+    # Back to back rentals are skipped together
+    ([(10, 12), (13, 15)], (11, 12), (16, 17)),
+    # Fits in the gap before the next rental
+    ([(10, 12), (20, 25)], (11, 13), (13, 15)),
+    # The gap is too short, so it goes after the next rental
+    ([(10, 12), (15, 20)], (11, 14), (21, 24)),
+    # A long rental that started before the wanted dates
+    ([(0, 40)], (5, 6), (41, 42)),
+])
+def test_next_free_window(app, owner, renter, bookings, wanted, window):
+    item = add_item(owner)
+    for start, end in bookings:
+        book(item, renter, start, end)
+    # Rentals of other items are not in the way
+    book(add_item(owner), renter, 0, 60)
+    start, end = next_free_window(item.id, day(wanted[0]), day(wanted[1]))
+    assert (start, end) == (day(window[0]), day(window[1]))
+    assert is_available(item.id, start, end)
+
+
+def test_rent_page_suggests_free_dates(client, owner, renter):
+    item = add_item(owner)
+    book(item, renter, 10, 12)
+    response = client.post(f'/rent/{item.id}', data={'startDate': day(11).isoformat(), 'endDate': day(13).isoformat()})
+    assert response.status_code == 200
+    assert f'the next free dates are {day(13)} to {day(15)}'.encode() in response.data
@@ -0,0 +1,40 @@
+import pytest
+from flaskapp import db, bcrypt
+from flaskapp.benchmarks.catalogue import PASSWORD
+from flaskapp.benchmarks.runner import run_benchmark, LoginFailed
+from flaskapp.models import Users
+from conftest import make_app, file_config, add_user, add_item
+
+
+@pytest.fixture
+def bench_app(tmp_path):
+    # Clients run in threads, so the database is a file they can all open
+    app = make_app(file_config(tmp_path / 'bench.db'))
+    with app.app_context():
+        owner = add_user('poster01')
+        add_item(owner)
+        db.session.add(Users(username='bench000001', password=bcrypt.generate_password_hash(PASSWORD, 4).decode('utf-8'), credit_balance=1000))
+        db.session.commit()
+        db.session.remove()
+    return app
+
+
+def test_run_reports_every_scenario(bench_app):
+    report = run_benchmark(bench_app, ('home', 'favourites', 'rent'), requests=5, clients=1, warmup=2)
+    for scenario in ('home', 'favourites', 'rent'):
+        assert report['scenarios'][scenario]['requests'] == 5
+        assert report['scenarios'][scenario]['errors'] == 0
+    assert report['total']['unexpected_statuses'] == {}
+
+
+def test_unexpected_statuses_are_errors(bench_app):
+    # Item 2 does not exist, requests for it are 404s
+    report = run_benchmark(bench_app, ('rent',), requests=4, clients=1, warmup=0, items=2, seed=3)
+    rent = report['scenarios']['rent']
+    assert 0 < rent['errors'] == rent['unexpected_statuses'].get('404')
+
+
+def test_run_stops_when_a_client_cannot_log_in(bench_app):
+    # There is only one benchmark user
+    with pytest.raises(LoginFailed):
+        run_benchmark(bench_app, ('home',), requests=2, clients=2, warmup=0)
@@ -0,0 +1,122 @@
+import threading
+import pytest
+from datetime import date, timedelta
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from flaskapp import db
+from flaskapp.bookings import book_rental, ItemUnavailable, InsufficientCredits
+from flaskapp.models import Users, Items, Rentals, ItemStats
+from flaskapp.stats import recompute_all, recompute_item, item_stats, stats_upsert, window_start
+from conftest import make_app, file_config, add_user, add_item, log_in
+
+
+def run_together(count, target):
+    # Starts count threads running target(number) and waits for them all
+    barrier = threading.Barrier(count)
+
+    def run(number):
+        barrier.wait()
+        target(number)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_overlapping_bookings_only_one_wins(tmp_path):
+    app = make_app(file_config(tmp_path / 'bookings.db'))
+    with app.app_context():
+        owner = add_user('poster01', credit_balance=0)
+        owner_id = owner.id
+        renter_ids = [add_user(f'renter{n:02d}').id for n in range(8)]
+        item_id = add_item(owner).id
+        total = db.session.query(db.func.sum(Users.credit_balance)).scalar()
+        db.session.remove()
+
+    outcomes = []
+    startDate = date.today() + timedelta(days=5)
+
+    def rent(number):
+        with app.app_context():
+            try:
+                book_rental(Items.query.get(item_id), Users.query.get(renter_ids[number]), startDate, startDate + timedelta(days=2), 10)
+                outcomes.append('booked')
+            except ItemUnavailable:
+                outcomes.append('unavailable')
+            finally:
+                db.session.remove()
+
+    run_together(len(renter_ids), rent)
+
+    with app.app_context():
+        assert sorted(outcomes) == ['booked'] + ['unavailable'] * (len(renter_ids) - 1)
+        assert Rentals.query.filter_by(itemID=item_id).count() == 1
+        # Credits only moved from the renter to the owner
+        assert db.session.query(db.func.sum(Users.credit_balance)).scalar() == total
+        assert db.session.get(Users, owner_id).credit_balance == 10
+
+
+def test_first_rentals_at_once_all_succeed(tmp_path):
+    # Every request creates the item's stats row when pricing, none may fail on it
+    app = make_app(file_config(tmp_path / 'stats.db'))
+    with app.app_context():
+        owner = add_user('poster01')
+        usernames = [add_user(f'renter{n:02d}', credit_balance=1000).username for n in range(6)]
+        item_id = add_item(owner).id
+        db.session.remove()
+
+    statuses = []
+
+    def rent(number):
+        client = log_in(app.test_client(), usernames[number])
+        startDate = date.today() + timedelta(days=10 * number + 1)
+        response = client.post(f'/rent/{item_id}', data={'startDate': startDate.isoformat(), 'endDate': (startDate + timedelta(days=2)).isoformat()})
+        statuses.append(response.status_code)
+
+    run_together(len(usernames), rent)
+
+    with app.app_context():
+        assert statuses == [302] * len(usernames)
+        assert Rentals.query.filter_by(itemID=item_id).count() == len(usernames)
+        daysRented = db.session.get(ItemStats, item_id).daysRented
+        assert daysRented == 2 * len(usernames)
+        # Nothing drifted from what a full rebuild gives
+        recompute_all()
+        assert db.session.get(ItemStats, item_id).daysRented == daysRented
+
+
+def test_booking_needs_enough_credits(app, owner):
+    renter = add_user('renter01', credit_balance=5)
+    item = add_item(owner)
+    startDate = date.today() + timedelta(days=1)
+    try:
+        book_rental(item, renter, startDate, startDate + timedelta(days=1), 10)
+    except InsufficientCredits:
+        pass
+    else:
+        raise AssertionError('booking went through without enough credits')
+    assert Rentals.query.count() == 0
+    assert db.session.get(Users, renter.id).credit_balance == 5
+
+
+def test_recompute_keeps_a_current_row(app, owner):
+    item = add_item(owner)
+    stats = item_stats(item.id)
+    # Increments made since the row was created in this window are kept
+    stats.daysRented = 7
+    db.session.commit()
+    assert recompute_item(item.id).daysRented == 7
+    # A row from an older window is replaced
+    stats.windowStart = window_start() - timedelta(days=1)
+    db.session.commit()
+    assert recompute_item(item.id).daysRented == 0
+
+
+@pytest.mark.parametrize('name, dialect, clause', [
+    ('mysql', mysql.dialect(), 'ON DUPLICATE KEY UPDATE'),
+    ('postgresql', postgresql.dialect(), 'ON CONFLICT'),
+    ('sqlite', sqlite.dialect(), 'ON CONFLICT'),
+])
+def test_stats_upsert_compiles_for_each_backend(name, dialect, clause):
+    assert clause in str(stats_upsert(name, 1, 2, 3, date.today()).compile(dialect=dialect))
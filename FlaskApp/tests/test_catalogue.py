@@ -0,0 +1,86 @@
+import json
+import os
+import pytest
+from PIL import Image
+from flaskapp import db
+from flaskapp.models import Items, ImageJobs
+from conftest import add_item
+
+
+def write_rows(path, rows):
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write((row if isinstance(row, str) else json.dumps(row)) + '\n')
+    return str(path)
+
+def run_import(app, source, *options):
+    result = app.test_cli_runner().invoke(args=['items', 'import', source, '--workers', '0'] + list(options))
+    assert result.exception is None, result.output
+    return result.output
+
+def row(**fields):
+    values = {'owner': 'poster01', 'typeOfClothing': 'Dress', 'colour': 'Black', 'size': 'M', 'brand': 'Zara', 'minimumCredits': 10}
+    values.update(fields)
+    return values
+
+
+def test_import_stores_images(app, owner, image_store, tmp_path):
+    pictures = tmp_path / 'pictures'
+    pictures.mkdir()
+    Image.new('RGB', (40, 30), (200, 0, 0)).save(pictures / 'red.png')
+    source = write_rows(tmp_path / 'rows.jsonl', [row(image='red.png'), row(image='red.png', colour='Red')])
+    output = run_import(app, source, '--images', str(pictures), '--defer-images')
+    assert 'Imported 2 items, skipped 0' in output
+    items = Items.query.all()
+    # The same photo is stored once
+    assert len({item.image_file for item in items}) == 1
+    assert os.path.isfile(os.path.join(image_store, items[0].image_file))
+    assert ImageJobs.query.count() == 2
+
+
+def test_import_only_reads_images_inside_the_folder(app, owner, image_store, tmp_path):
+    pictures = tmp_path / 'pictures'
+    pictures.mkdir()
+    outside = tmp_path / 'secret.png'
+    Image.new('RGB', (10, 10)).save(outside)
+    os.symlink(outside, pictures / 'link.png')
+    (pictures / 'notes.png').write_text('not an image')
+    (pictures / 'anim.gif').write_bytes(b'GIF89a')
+    before = set(os.listdir(image_store))
+    source = write_rows(tmp_path / 'rows.jsonl', [
+        row(image=str(outside)),
+        row(image='../secret.png'),
+        row(image='link.png'),
+        row(image='anim.gif'),
+        row(image='notes.png'),
+        '[1, 2]',
+    ])
+    output = run_import(app, source, '--images', str(pictures), '--defer-images')
+    assert 'Imported 0 items, skipped 6' in output
+    assert output.count('outside the --images folder') == 3
+    assert 'must be a .jpg or .png file' in output
+    assert 'not a JPEG or PNG image' in output
+    assert 'expected a JSON object' in output
+    assert set(os.listdir(image_store)) == before
+    assert Items.query.count() == 0 and ImageJobs.query.count() == 0
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_export_reads_back(app, owner, image_store, tmp_path, fmt):
+    Image.new('RGB', (20, 20), (0, 0, 200)).save(tmp_path / 'blue.png')
+    run_import(app, write_rows(tmp_path / 'rows.jsonl', [row(image='blue.png', brand='Gucci')]), '--images', str(tmp_path))
+    add_item(owner, brand='n/a', colour='Red')
+    add_item(owner, image_file='default.png', size='XL')
+    exported = [(item.userID, item.typeOfClothing, item.colour, item.size, item.brand, item.minimumCredits, item.image_file) for item in Items.query.order_by(Items.id)]
+
+    target = str(tmp_path / f'items.{fmt}')
+    result = app.test_cli_runner().invoke(args=['items', 'export', target, '--images', str(tmp_path / 'export')])
+    assert 'Exported 3 items' in result.output
+    Items.query.delete()
+    ImageJobs.query.delete()
+    db.session.commit()
+
+    output = run_import(app, target, '--images', str(tmp_path / 'export'))
+    assert 'Imported 3 items, skipped 0' in output
+    imported = [(item.userID, item.typeOfClothing, item.colour, item.size, item.brand, item.minimumCredits, item.image_file) for item in Items.query.order_by(Items.id)]
+    assert imported == exported
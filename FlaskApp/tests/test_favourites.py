@@ -0,0 +1,46 @@
+import pytest
+from flaskapp.favourites import favourite_ids
+from conftest import add_item
+
+
+def test_bulk_add_and_remove(client, renter, owner):
+    first, second = add_item(owner), add_item(owner)
+    response = client.post('/favourites/bulk', json={'add': [first.id, str(second.id), 999]})
+    assert response.status_code == 200
+    assert response.json == {'added': [first.id, second.id], 'removed': [], 'favourites': [first.id, second.id]}
+    response = client.post('/favourites/bulk', json={'remove': [first.id]})
+    assert response.json['removed'] == [first.id]
+    assert favourite_ids(renter.id) == {second.id}
+
+
+def test_adding_twice_keeps_one_favourite(client, renter, owner):
+    item = add_item(owner)
+    client.post('/favourites/bulk', json={'add': [item.id]})
+    response = client.post('/favourites/bulk', json={'add': [item.id]})
+    assert response.json['added'] == []
+    assert favourite_ids(renter.id) == {item.id}
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'add',
+    {'add': '12'},
+    {'add': 5},
+    {'remove': {'1': True}},
+    {'add': [True]},
+    {'add': [1.5]},
+    {'add': ['x']},
+    {'add': [None]},
+])
+def test_bulk_rejects_malformed_bodies(client, body):
+    response = client.post('/favourites/bulk', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+def test_bulk_rejects_bad_json(client):
+    response = client.post('/favourites/bulk', data='{"add": [1', content_type='application/json')
+    assert response.status_code == 400
+
+def test_bulk_needs_login(app):
+    response = app.test_client().post('/favourites/bulk', json={'add': [1]})
+    assert response.status_code == 401
@@ -0,0 +1,67 @@
+import pytest
+from datetime import date, timedelta
+from flaskapp import db
+from flaskapp.identity import identity_cache
+from flaskapp.models import Users, load_user
+from conftest import make_app, add_user, add_item, log_in
+
+
+@pytest.fixture
+def site():
+    # No app context is kept open around the requests, Flask-Login would otherwise keep
+    # the first user it loads in g for every request of the test
+    app = make_app()
+    with app.app_context():
+        owner = add_user('poster01')
+        add_user('renter01')
+        item_id = add_item(owner).id
+    return app, item_id
+
+def balance_shown(client):
+    # The nav bar shows the logged in user's credits
+    return client.get('/home').data.split(b'nav-link" >')[-1].split(b'<')[0].decode()
+
+
+def test_logged_in_user_comes_from_the_cache(site):
+    app, _ = site
+    client = log_in(app.test_client(), 'renter01')
+    client.get('/home')
+    hits = app.extensions['identity_cache'].stats()['hits']
+    client.get('/home')
+    assert app.extensions['identity_cache'].stats()['hits'] == hits + 1
+
+
+def test_booking_refreshes_both_balances(site):
+    app, item_id = site
+    renter = log_in(app.test_client(), 'renter01')
+    owner = log_in(app.test_client(), 'poster01')
+    assert balance_shown(renter) == '100' and balance_shown(owner) == '100'
+    startDate = date.today() + timedelta(days=3)
+    response = renter.post(f'/rent/{item_id}', data={'startDate': startDate.isoformat(), 'endDate': (startDate + timedelta(days=2)).isoformat()})
+    assert response.status_code == 302
+    # 10 minimum credits and 5 a day
+    assert balance_shown(renter) == '80'
+    assert balance_shown(owner) == '120'
+
+
+def test_password_hash_is_not_cached(app, renter):
+    load_user(renter.id)
+    assert identity_cache.get(renter.id) == {'id': renter.id, 'username': 'renter01', 'credit_balance': 100}
+
+
+def test_entries_expire(app, renter):
+    app.config['USER_CACHE_TTL'] = -1
+    load_user(renter.id)
+    # Changed by another worker, this process is not told
+    db.session.get(Users, renter.id).credit_balance = 55
+    db.session.commit()
+    assert load_user(renter.id).credit_balance == 55
+
+
+def test_least_recently_used_are_dropped(app):
+    app.config['USER_CACHE_SIZE'] = 2
+    ids = [add_user(f'user{n:02d}').id for n in range(3)]
+    for user_id in ids:
+        load_user(user_id)
+    assert identity_cache.stats()['size'] == 2
+    assert identity_cache.get(ids[0]) is None and identity_cache.get(ids[2]) is not None
@@ -0,0 +1,71 @@
+import io
+import os
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from flaskapp.images import make_variants, variant_name, thumbnail_filter, VARIANTS
+from flaskapp.storage import store_upload
+from conftest import add_item
+
+
+def upload(colour=(0, 120, 200), filename='photo.PNG'):
+    data = io.BytesIO()
+    Image.new('RGB', (60, 40), colour).save(data, 'PNG')
+    data.seek(0)
+    return FileStorage(stream=data, filename=filename)
+
+
+def test_same_upload_is_stored_once(app, image_store):
+    first = store_upload(upload())
+    second = store_upload(upload(filename='copy.png'))
+    assert first == second and first.endswith('.png')
+    assert store_upload(upload(colour=(0, 0, 0))) != first
+    # Nothing left behind by the second upload
+    assert not [name for name in os.listdir(image_store) if name.endswith('.part')]
+
+
+def test_variant_names_carry_their_settings(app, image_store):
+    image_fn = store_upload(upload())
+    thumb = variant_name(image_fn, 'thumbs')
+    assert thumb.startswith('thumbs/' + image_fn[:-4] + '-250x250-q80.')
+    # The original until the variants exist
+    assert thumbnail_filter(image_fn) == image_fn
+    make_variants(image_fn)
+    assert thumbnail_filter(image_fn) == thumb
+    app.config['IMAGE_QUALITY'] = 60
+    assert variant_name(image_fn, 'thumbs') != thumb
+    assert thumbnail_filter(image_fn) == image_fn
+
+
+def test_stored_images_are_immutable(app, image_store):
+    image_fn = store_upload(upload())
+    make_variants(image_fn)
+    client = app.test_client()
+    for name in [image_fn] + [variant_name(image_fn, variant) for variant in VARIANTS]:
+        response = client.get('/static/image_pics/' + name)
+        assert response.status_code == 200
+        assert response.cache_control.immutable and response.cache_control.max_age == app.config['IMAGE_CACHE_MAX_AGE']
+        response.close()
+    # Older uploads have random names and keep revalidating
+    response = client.get('/static/image_pics/dress.png')
+    assert not response.cache_control.immutable
+    response.close()
+
+
+def test_gc_keeps_referenced_images(app, owner, image_store):
+    kept = store_upload(upload())
+    dropped = store_upload(upload(colour=(0, 0, 0)))
+    add_item(owner, image_file=kept)
+    make_variants(kept)
+    make_variants(dropped)
+    # Variants made with old settings are no longer used
+    app.config['IMAGE_QUALITY'] = 60
+    stale = variant_name(kept, 'thumbs')
+    make_variants(kept)
+    app.config['IMAGE_QUALITY'] = 80
+
+    # A dry run, the sample images in the folder are not referenced by the test database
+    result = app.test_cli_runner().invoke(args=['images', 'gc', '--dry-run'])
+    assert result.exception is None, result.output
+    listed = set(result.output.splitlines())
+    assert not listed & {kept, *(variant_name(kept, variant) for variant in VARIANTS)}
+    assert {dropped, stale, variant_name(dropped, 'display')} <= listed
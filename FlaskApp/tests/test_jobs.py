@@ -0,0 +1,77 @@
+import io
+from datetime import datetime, timedelta
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from flaskapp import db
+from flaskapp.images import has_variants
+from flaskapp.jobs import enqueue, claim, run_job, drain
+from flaskapp.models import Items, ImageJobs
+from flaskapp.storage import store_upload
+from conftest import add_item
+
+
+def queue(owner, image_file):
+    item = add_item(owner, image_file=image_file)
+    enqueue(item)
+    db.session.commit()
+    return item
+
+def make_due(job_id):
+    db.session.get(ImageJobs, job_id).runAfter = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_job_makes_the_variants(app, owner, image_store):
+    data = io.BytesIO()
+    Image.new('RGB', (80, 60), (10, 200, 10)).save(data, 'PNG')
+    data.seek(0)
+    item = queue(owner, store_upload(FileStorage(stream=data, filename='photo.png')))
+    assert item.image_status == 'pending'
+    assert drain() == 1
+    job = ImageJobs.query.one()
+    assert (job.status, job.attempts, job.error) == ('done', 1, None)
+    assert db.session.get(Items, item.id).image_status == 'ready'
+    assert has_variants(item.image_file)
+
+
+def test_failed_job_backs_off_then_fails(app, owner):
+    app.config.update(IMAGE_JOB_RETRIES=3, IMAGE_JOB_RETRY_DELAY=30)
+    item = queue(owner, 'missing.png')
+    job_id = claim()
+    started = datetime.utcnow()
+    assert run_job(job_id) == 'queued'
+    job = db.session.get(ImageJobs, job_id)
+    assert job.attempts == 1 and 'missing.png' in job.error
+    assert job.runAfter >= started + timedelta(seconds=30)
+    # Not due again until the delay has passed
+    assert claim() is None
+
+    make_due(job_id)
+    assert run_job(claim()) == 'queued'
+    # The delay doubles after every attempt
+    assert db.session.get(ImageJobs, job_id).runAfter >= started + timedelta(seconds=60)
+
+    make_due(job_id)
+    assert run_job(claim()) == 'failed'
+    assert db.session.get(ImageJobs, job_id).attempts == 3
+    assert db.session.get(Items, item.id).image_status == 'failed'
+    make_due(job_id)
+    assert claim() is None
+
+
+def test_a_job_is_claimed_once(app, owner):
+    queue(owner, 'dress.png')
+    job_id = claim()
+    assert job_id is not None
+    assert claim() is None
+
+
+def test_stuck_jobs_are_claimed_again(app, owner):
+    queue(owner, 'dress.png')
+    job_id = claim()
+    # The worker running it died
+    job = db.session.get(ImageJobs, job_id)
+    job.updated = datetime.utcnow() - timedelta(seconds=app.config['IMAGE_JOB_TIMEOUT'] + 1)
+    db.session.commit()
+    assert claim() == job_id
+    assert db.session.get(ImageJobs, job_id).attempts == 2
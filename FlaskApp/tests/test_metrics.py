@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from flaskapp import db
+
+
+def test_metrics_count_requests_and_sql(client):
+    response = client.get('/home')
+    assert 'db;dur=' in response.headers['Server-Timing']
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'flaskapp_requests_total{endpoint="main.homePage",status="200"} 1' in body
+    assert 'flaskapp_request_duration_seconds_bucket{endpoint="main.homePage",le="+Inf"} 1' in body
+    assert 'flaskapp_sql_statements_total{endpoint="main.homePage"}' in body
+    assert '# TYPE flaskapp_page_cache_hits_total counter' in body
+
+
+@pytest.mark.parametrize('environ, headers, status', [
+    ({}, {}, 200),
+    ({'REMOTE_ADDR': '10.0.0.5'}, {}, 404),
+    # A reverse proxy on the same machine makes every request come from 127.0.0.1
+    ({}, {'X-Forwarded-For': '203.0.113.9'}, 404),
+    ({}, {'Forwarded': 'for=203.0.113.9'}, 404),
+])
+def test_metrics_only_for_the_local_machine(app, environ, headers, status):
+    response = app.test_client().get('/metrics', environ_base=environ, headers=headers)
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({'Authorization': 'Bearer s3cret'}, 200),
+    ({'Authorization': 'Bearer wrong'}, 404),
+    ({}, 404),
+])
+def test_metrics_token(app, headers, status):
+    app.config['METRICS_TOKEN'] = 's3cret'
+    # The token is needed from anywhere, the local machine included
+    response = app.test_client().get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'}, headers=headers)
+    assert response.status_code == status
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_failed_statements_leave_no_start_time(app):
+    with db.engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text('SELECT * FROM "NoSuchTable"'))
+            connection.rollback()
+        assert connection.info.get('query_started') == []
+        connection.execute(text('SELECT 1'))
+        assert connection.info['query_started'] == []
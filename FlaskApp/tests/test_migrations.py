@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import text
+from flaskapp import create_app, db
+from flaskapp.migrations import upgrade, full_scans, PendingMigrations
+from flaskapp.warmup import warm
+from conftest import file_config
+
+
+def test_warm_refuses_an_old_schema(tmp_path):
+    app = create_app(file_config(tmp_path / 'old.db'))
+    with pytest.raises(PendingMigrations, match='flask db upgrade'):
+        warm(app)
+    with app.app_context():
+        upgrade()
+    warm(app)
+    assert app.test_client().get('/').status_code == 200
+
+
+def test_upgrade_runs_each_migration_once(app):
+    assert upgrade() == []
+
+
+def test_hot_queries_use_indexes(app):
+    result = app.test_cli_runner().invoke(args=['db', 'check-plans'])
+    assert result.exit_code == 0, result.output
+    assert 'hot queries use an index' in result.output
+
+
+def test_check_plans_fails_on_a_missing_index(app):
+    db.session.execute(text('DROP INDEX "ix_Rentals_itemID_startDate_endDate"'))
+    db.session.commit()
+    with db.engine.connect() as connection:
+        problems, _ = full_scans(connection)
+    assert {name for name, _ in problems} >= {'rental overlap', 'rented days', 'next free dates'}
+    result = app.test_cli_runner().invoke(args=['db', 'check-plans'])
+    assert result.exit_code != 0
+    assert 'rental overlap: SCAN' in result.output
+
+
+def test_unused_image_index_is_dropped(app):
+    # A database migrated before m0006 still has it
+    db.session.execute(text('CREATE INDEX "ix_Items_image_file" ON "Items" (image_file)'))
+    db.session.execute(text("DELETE FROM schema_migrations WHERE id = 'm0006_drop_image_file_index'"))
+    db.session.commit()
+    assert upgrade() == ['m0006_drop_image_file_index']
+    indexes = {row[0] for row in db.session.execute(text("SELECT name FROM sqlite_master WHERE tbl_name = 'Items'"))}
+    assert 'ix_Items_image_file' not in indexes and 'ix_Items_userID' in indexes
@@ -0,0 +1,81 @@
+import json
+import os
+import pickle
+from flaskapp.pagecache import FileBackend
+from conftest import make_app, file_config, add_user, add_item, log_in
+
+
+def test_unchanged_home_page_is_a_304(client, owner):
+    add_item(owner)
+    first = client.get('/home')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    again = client.get('/home', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+
+def test_favouriting_changes_the_etag(client, owner):
+    item = add_item(owner)
+    etag = client.get('/home').headers['ETag']
+    client.get(f'/favourite/{item.id}')
+    response = client.get('/home', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_favourites_page_shows_changes(client, owner):
+    item = add_item(owner, brand='Prada')
+    assert b'Prada' not in client.get('/favourites').data
+    client.get(f'/favourite/{item.id}')
+    assert b'Prada' in client.get('/favourites').data
+    client.get(f'/unfavourite/{item.id}')
+    assert b'Prada' not in client.get('/favourites').data
+
+
+def test_writes_in_another_process_invalidate(tmp_path):
+    # Two apps on one database stand in for two worker processes
+    config = file_config(tmp_path / 'shared.db')
+    first, second = make_app(config), make_app(config)
+    with first.app_context():
+        owner = add_user('poster01')
+        add_user('renter01')
+        item_id = add_item(owner).id
+    one = log_in(first.test_client(), 'renter01')
+    two = log_in(second.test_client(), 'renter01')
+
+    etag = two.get('/home').headers['ETag']
+    assert two.get('/home', headers={'If-None-Match': etag}).status_code == 304
+    one.get(f'/favourite/{item_id}')
+    response = two.get('/home', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_file_backend_stores_json(tmp_path):
+    backend = FileBackend(str(tmp_path), 1000)
+    backend.put(('home', 1), '<p>caf\u00e9</p>', 30)
+    assert backend.get(('home', 1)) == '<p>caf\u00e9</p>'
+    with open(backend._file(('home', 1)), encoding='utf-8') as f:
+        assert json.load(f)[1] == '<p>caf\u00e9</p>'
+    backend.put(('home', 2), 'old', -1)
+    assert backend.get(('home', 2)) is None
+
+
+def test_file_backend_never_unpickles(tmp_path):
+    backend = FileBackend(str(tmp_path), 1000)
+    with open(backend._file(('home', 1)), 'wb') as f:
+        pickle.dump((float('inf'), 'html'), f)
+    assert backend.get(('home', 1)) is None
+
+
+def test_file_backend_prunes_now_and_then(tmp_path):
+    backend = FileBackend(str(tmp_path), 1000)
+    scans = []
+    prune = backend._prune
+    backend._prune = lambda: scans.append(prune())
+    for number in range(50):
+        backend.put(('home', number), 'x' * 50, 30)
+    # A tenth of the limit is 100 bytes, two entries' worth
+    assert len(scans) == 25
+    # Over the limit by at most what was written since the last prune
+    assert backend.stats()['bytes'] < 1200
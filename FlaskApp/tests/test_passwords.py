@@ -0,0 +1,56 @@
+import threading
+import pytest
+from flaskapp import db, bcrypt
+from flaskapp.models import Users
+from flaskapp.passwords import password_hasher, check_password, needs_rehash, HashingBusy
+from conftest import PASSWORD, add_user
+
+
+def test_login_upgrades_an_old_hash(app):
+    user = add_user('renter01')
+    user.password = bcrypt.generate_password_hash(PASSWORD, 5).decode('utf-8')
+    db.session.commit()
+    assert needs_rehash(user.password)
+
+    response = app.test_client().post('/login', data={'username': 'renter01', 'password': PASSWORD})
+    assert response.status_code == 302
+    stored = db.session.get(Users, user.id).password
+    assert stored.startswith('$2b$04$') and not needs_rehash(stored)
+    assert bcrypt.check_password_hash(stored, PASSWORD)
+
+
+def test_wrong_password_keeps_the_hash(app):
+    user = add_user('renter01')
+    user.password = old = bcrypt.generate_password_hash(PASSWORD, 5).decode('utf-8')
+    db.session.commit()
+    assert not check_password(user, 'wrong')
+    assert db.session.get(Users, user.id).password == old
+
+
+def test_hashing_gives_up_when_busy(app):
+    app.config.update(PASSWORD_HASH_QUEUE=1, PASSWORD_HASH_TIMEOUT=0.05)
+    add_user('renter01')
+    running, release = threading.Event(), threading.Event()
+
+    def hold():
+        running.set()
+        release.wait(5)
+
+    def slow_request():
+        with app.app_context():
+            password_hasher.run(hold)
+
+    # The one place is taken by a slow hash from another request
+    worker = threading.Thread(target=slow_request)
+    worker.start()
+    try:
+        assert running.wait(5)
+        with pytest.raises(HashingBusy):
+            password_hasher.run(bcrypt.check_password_hash, 'x', 'y')
+        response = app.test_client().post('/login', data={'username': 'renter01', 'password': PASSWORD})
+        assert response.status_code == 200
+        assert b'The site is busy' in response.data
+    finally:
+        release.set()
+        worker.join()
+    assert password_hasher.stats()['queue_depth'] == 0
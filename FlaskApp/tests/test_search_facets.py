@@ -0,0 +1,96 @@
+from flaskapp.facets import facet_index, ids_of, bitmap_of
+from flaskapp.search import search_index
+from conftest import add_item
+
+
+def test_search_ranks_items_matching_more_words(app, owner):
+    both = add_item(owner, colour='Red', brand='Zara')
+    colour = add_item(owner, colour='Red', brand='Nike')
+    add_item(owner, colour='Blue', brand='Nike')
+    assert search_index.rank('red ZARA') == [both.id, colour.id]
+    assert search_index.rank('purple') == []
+
+
+def test_search_picks_up_new_items(app, owner):
+    add_item(owner, brand='Zara')
+    assert len(search_index.rank('zara')) == 1
+    # Rows written after the first refresh, e.g. by another worker
+    add_item(owner, brand='Zara')
+    assert len(search_index.rank('zara')) == 2
+
+
+def test_search_results_are_capped(client, app, owner):
+    app.config['SEARCH_RESULTS'] = 2
+    red = add_item(owner, colour='Red', brand='Gucci')
+    add_item(owner, brand='Gucci')
+    add_item(owner, brand='Gucci')
+    assert search_index.rank('red gucci', 2) == [red.id, red.id + 1]
+    response = client.post('/search', data={'searched': 'red gucci'})
+    assert response.data.count(b'Brand: Gucci') == 2
+
+
+def test_search_page(client, owner):
+    add_item(owner, brand='Gucci')
+    response = client.post('/search', data={'searched': 'gucci'})
+    assert response.status_code == 200
+    assert b'Gucci' in response.data
+
+
+def test_facet_counts_ignore_their_own_selection(app, owner):
+    black = add_item(owner, colour='Black', size='M')
+    add_item(owner, colour='Red', size='M')
+    add_item(owner, colour='Red', size='L')
+    matches, counts = facet_index.filter({'colour': ['Black'], 'size': ['M']})
+    assert ids_of(matches) == [black.id]
+    # Colour counts are for size M only, size counts for black only
+    assert counts['colour']['Black'] == 1 and counts['colour']['Red'] == 1
+    assert counts['size']['M'] == 1 and counts['size']['L'] == 0
+
+
+def test_brand_counts_follow_the_other_filters(app, owner):
+    zara = add_item(owner, colour='Black', brand='Zara')
+    add_item(owner, colour='Red', brand='Zara')
+    add_item(owner, colour='Red', brand='Nike')
+    add_item(owner, colour='Red', brand='')
+    _, counts = facet_index.filter({})
+    assert counts['brand'] == {'Zara': 2, 'Nike': 1}
+    matches, counts = facet_index.filter({'colour': ['Black'], 'brand': ['Zara', 'Gap']})
+    assert ids_of(matches) == [zara.id]
+    assert counts['brand'] == {'Zara': 1}
+    assert counts['colour']['Red'] == 1
+
+
+def test_bitmap_ids_round_trip():
+    ids = [1, 7, 8, 63, 64, 1000]
+    assert ids_of(bitmap_of(ids)) == ids
+    assert ids_of(bitmap_of(ids), after=8, limit=2) == [63, 64]
+    assert ids_of(0) == [] and bitmap_of([]) == 0
+
+
+def test_credit_range(app, owner):
+    cheap = add_item(owner, minimumCredits=5)
+    add_item(owner, minimumCredits=50)
+    matches, _ = facet_index.filter({}, low=1, high=10)
+    assert ids_of(matches) == [cheap.id]
+
+
+def test_items_endpoint(client, owner):
+    first = add_item(owner, colour='Black', brand='zara')
+    add_item(owner, colour='Red')
+    response = client.get('/items?colour=black&size=m')
+    assert response.status_code == 200
+    assert response.json['total'] == 1
+    assert [item['id'] for item in response.json['items']] == [first.id]
+    assert response.json['facets']['colour']['Red'] == 1
+
+
+def test_items_pagination(client, app, owner):
+    app.config['ITEMS_PER_PAGE'] = 2
+    ids = [add_item(owner).id for _ in range(3)]
+    page = client.get('/items').json
+    assert [item['id'] for item in page['items']] == ids[:2]
+    page = client.get(page['next']).json
+    assert [item['id'] for item in page['items']] == ids[2:]
+    assert page['next'] is None
+    # A bad cursor is treated as the start
+    assert client.get('/items?after=-5').json['total'] == 3
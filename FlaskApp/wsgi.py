@@ -0,0 +1,74 @@
+import os
+import signal
+import socket
+import sys
+from flaskapp import create_app
+from flaskapp.warmup import warm
+
+# Production entry point. The app is built and warmed once here, then every worker is forked
+# from this process, so workers start with compiled templates and loaded search indexes.
+# Apply migrations with 'flask --app flaskapp db upgrade' first, warming refuses an older schema.
+#   python wsgi.py --workers 4 --port 8000
+# or with gunicorn, which must load the app before forking:
+#   gunicorn --preload --workers 4 wsgi:app
+# Forking needs a POSIX system. On Windows --workers is ignored and one threaded process
+# serves everything, run several behind a proxy or use waitress for more.
+
+app = warm(create_app())
+
+
+def serve(host, port, workers):
+    from werkzeug.serving import make_server
+
+    if not hasattr(os, 'fork'):
+        if workers > 1:
+            app.logger.warning('No fork on this platform, serving with one process instead of %d', workers)
+        make_server(host, port, app, threaded=True).serve_forever()
+        return
+
+    # One listening socket made before forking, the workers take turns accepting on it
+    listener = socket.create_server((host, port), backlog=2048, reuse_port=False)
+    listener.set_inheritable(True)
+
+    def worker():
+        server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        server.serve_forever()
+
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    app.logger.warning('Serving on http://%s:%d with %d workers, started in %.2fs', host, port, workers, app.extensions['startup'].report()['total'])
+
+    # Replace any worker that dies
+    while True:
+        pid, _ = os.wait()
+        children.discard(pid)
+        spawn()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the site with pre-forked workers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)